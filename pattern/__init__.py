@@ -1,6 +1,10 @@
+from .binary import *
+from .cache import *
+from .executor import *
 from .field import *
 from .mask import *
 from .objective import *
 from .ops import *
+from .propagator import *
 from .slm import SLM
 from .synthesizer import *
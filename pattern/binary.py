@@ -0,0 +1,143 @@
+import logging
+
+import numpy as np
+
+__all__ = ["BinaryPattern"]
+
+logger = logging.getLogger(__name__)
+
+# exp(1j * pi * bit) of the 8 bits of every byte, most significant bit first
+_SIGNS = 1 - 2 * np.unpackbits(
+    np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1
+).astype(np.int8)
+
+
+class BinaryPattern(object):
+    """
+    Binary SLM pattern packed 1 bit per pixel. Rows are packed along X, most
+    significant bit first, and padded with zeros to whole bytes, which is the
+    layout of a 1-bit BMP.
+
+    Args:
+        bits (np.ndarray): packed rows, of shape (ny, ceil(nx / 8))
+        width (int): number of pixels in a row
+        cf_search (CfSearch, optional): search of the cf the pattern is generated
+            with, see `Synthesizer.select_cf`
+    """
+
+    def __init__(self, bits, width, cf_search=None):
+        bits = np.ascontiguousarray(bits, np.uint8)
+        if bits.ndim != 2 or bits.shape[1] != -(-width // 8):
+            raise ValueError(f"packed rows of shape {bits.shape} do not fit {width} px")
+        self._bits, self._width = bits, width
+        self._cf_search = cf_search
+
+    def __array__(self, dtype=None, copy=None):
+        array = self.unpack()
+        return array if dtype is None else array.astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        return self.crop(*key)
+
+    def __repr__(self):
+        ny, nx = self.shape
+        return f"<BinaryPattern, {ny}x{nx}, {self.nbytes} bytes>"
+
+    ##
+
+    @classmethod
+    def pack(cls, pattern, cf_search=None):
+        """
+        Args:
+            pattern (np.ndarray): boolean pattern of shape (ny, nx)
+            cf_search (CfSearch, optional): search of the cf of the pattern
+        """
+        pattern = np.asarray(pattern)
+        if pattern.ndim != 2:
+            raise ValueError("pattern has to be 2-D")
+        return cls(np.packbits(pattern, axis=1), pattern.shape[1], cf_search)
+
+    ##
+
+    @property
+    def bits(self):
+        """Packed rows, C-contiguous."""
+        return self._bits
+
+    @property
+    def cf_search(self):
+        """Search of an automatic cf, None if the cf is given."""
+        return self._cf_search
+
+    @property
+    def dtype(self):
+        return np.dtype(np.bool_)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    @property
+    def shape(self):
+        return self.bits.shape[0], self._width
+
+    ##
+
+    def crop(self, ys, xs):
+        """
+        Region of the pattern, columns are realigned to whole bytes by shifting the
+        packed rows instead of unpacking them.
+
+        Args:
+            ys (slice or int): rows, an int keeps a single row
+            xs (slice): columns, with a step of 1
+        """
+        if isinstance(ys, (int, np.integer)):
+            ny = self.shape[0]
+            if not -ny <= ys < ny:
+                raise IndexError(f"row {ys} is out of bounds for {ny} row(s)")
+            ys %= ny
+            ys = slice(ys, ys + 1)
+        if not isinstance(xs, slice):
+            raise TypeError("columns can only be cropped by a slice")
+        start, stop, step = xs.indices(self._width)
+        if step != 1:
+            raise ValueError("columns can only be cropped with a step of 1")
+        width = max(0, stop - start)
+        n = -(-width // 8)
+
+        rows = self.bits[ys]
+        first, shift = divmod(start, 8)
+        if shift == 0:
+            bits = rows[:, first : first + n].copy()
+        else:
+            # each byte takes its tail from one byte and its head from the next one
+            bits = rows[:, first : first + n] << shift
+            tail = rows[:, first + 1 : first + n + 1]
+            bits[:, : tail.shape[1]] |= tail >> (8 - shift)
+
+        if width % 8:
+            # clear the padding
+            bits[:, -1] &= np.uint8(0xFF << (8 - width % 8) & 0xFF)
+        return BinaryPattern(bits, width, self.cf_search)
+
+    def unpack(self):
+        """Boolean pattern, 1 byte per pixel."""
+        return np.unpackbits(self.bits, axis=1, count=self._width).view(np.bool_)
+
+    def signs(self, dtype=np.float32):
+        """
+        exp(1j * pi * pattern), which is -1 where the pattern is set and 1
+        elsewhere, looked up byte by byte without unpacking the pattern.
+
+        Args:
+            dtype (np.dtype, optional): real dtype of the result
+        """
+        table = _SIGNS.astype(dtype)
+        ny, nx = self.shape
+        signs = table[self.bits].reshape(ny, -1)
+        if signs.shape[1] != nx:
+            signs = np.ascontiguousarray(signs[:, :nx])
+        return signs
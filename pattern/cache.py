@@ -0,0 +1,163 @@
+"""
+Content-addressed cache of synthesis and simulation results on disk.
+
+The cache directory defaults to PATTERN_CACHE_DIR, or ~/.cache/pattern if it is not
+set.
+"""
+
+from hashlib import sha256
+import logging
+import os
+import uuid
+
+import numpy as np
+
+__all__ = ["DiskCache"]
+
+logger = logging.getLogger(__name__)
+
+# bump to invalidate entries of earlier revisions
+CACHE_VERSION = 1
+
+
+class DiskCache(object):
+    """
+    Arrays keyed by the fingerprint of whatever produced them. Entries are stored
+    as .npy and loaded memory-mapped read-only, the least recently used ones are
+    evicted once the total size exceeds the limit.
+
+    Args:
+        root (str, optional): directory of the cache
+        max_size (int, optional): size limit in bytes
+    """
+
+    def __init__(self, root=None, max_size=1 << 32):
+        if root is None:
+            root = os.environ.get(
+                "PATTERN_CACHE_DIR", os.path.join("~", ".cache", "pattern")
+            )
+        self._root = os.path.abspath(os.path.expanduser(root))
+        os.makedirs(self._root, exist_ok=True)
+        self._max_size = max_size
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__}, root="{self.root}">'
+
+    ##
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @property
+    def root(self):
+        return self._root
+
+    @property
+    def size(self):
+        """Total size of the entries in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    ##
+
+    @staticmethod
+    def fingerprint(*parts):
+        """
+        Key of a result, from the representation of everything it depends on.
+
+        Args:
+            *parts: objects that determine the result, their `repr` has to capture
+                all of their parameters
+        """
+        digest = sha256(f"v{CACHE_VERSION}".encode())
+        for part in parts:
+            digest.update(b"\0")
+            digest.update(repr(part).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Load an entry, None if it does not exist.
+
+        Returns:
+            (np.ndarray): read-only memory-mapped array
+        """
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # recently used
+        logger.debug(f"cache hit {key[:8]}")
+        return array
+
+    def put(self, key, array):
+        """
+        Store an entry, and evict the least recently used ones beyond the limit.
+
+        Returns:
+            (np.ndarray): the stored entry, memory-mapped
+        """
+        path = self._path(key)
+        # write aside then move, readers never see a partial entry
+        tmp_path = os.path.join(self.root, f".{uuid.uuid4().hex}.tmp.npy")
+        np.save(tmp_path, np.asarray(array))
+        os.replace(tmp_path, path)
+        logger.debug(f"cache store {key[:8]}, {os.path.getsize(path)} bytes")
+
+        self.evict(keep=key)
+        return np.load(path, mmap_mode="r")
+
+    def lookup(self, key, func):
+        """Load an entry, or generate it by func() and store it."""
+        array = self.get(key)
+        if array is None:
+            array = self.put(key, func())
+        return array
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache fits its limit.
+
+        Args:
+            keep (str, optional): key that is never evicted
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_size:
+                break
+            if keep is not None and path == self._path(keep):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug(f'evicted "{os.path.basename(path)}"')
+
+    def clear(self):
+        """Remove all the entries."""
+        for path, _, _ in self._entries():
+            os.remove(path)
+
+    ##
+
+    def _entries(self):
+        """(path, size, last use) of all the entries."""
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.startswith(".") or not entry.name.endswith(".npy"):
+                continue
+            stat = entry.stat()
+            entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.npy")
@@ -0,0 +1,321 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from multiprocessing import Pool
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+from .fft import get_backend, set_backend, set_workers
+from .field import Support
+from .propagator import REDUCTIONS, Propagator, _merge_reductions
+from .shared import SharedArray
+
+__all__ = ["Executor"]
+
+logger = logging.getLogger(__name__)
+
+
+class Executor(object):
+    """
+    Session that runs the per-plane work of many simulations. Workers are spawned
+    on first use and kept warm, along with their FFT plans and the grids shared with
+    them, until the session is closed. A closed session cannot be used again.
+
+    Args:
+        kind (str, optional): "serial", "threads" or "processes"
+        workers (int, optional): number of workers, default to all the cores
+        memory (int, optional): memory budget in bytes, split among the workers
+    """
+
+    KINDS = ("serial", "threads", "processes")
+
+    def __init__(self, kind="serial", workers=None, memory=1 << 29):
+        if kind not in Executor.KINDS:
+            raise ValueError(f'unknown executor "{kind}"')
+        self._kind = kind
+        if kind == "serial":
+            workers = 1
+        self._workers = workers if workers else os.cpu_count()
+        self._memory = memory
+
+        self._pool = None
+        self._grids = OrderedDict()  # id -> (array, shared array)
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    ##
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def memory(self):
+        return self._memory
+
+    @property
+    def workers(self):
+        return self._workers
+
+    ##
+
+    def close(self):
+        """Shut down the workers and release the shared grids."""
+        self._closed = True
+        if self._pool is not None:
+            if self.kind == "processes":
+                self._pool.close()
+                self._pool.join()
+            else:
+                self._pool.shutdown()
+            self._pool = None
+            logger.debug(f"{self.kind} pool shut down")
+        for _, shared in self._grids.values():
+            shared.close()
+        self._grids.clear()
+
+    def map(self, func, iterable):
+        """
+        Apply a function to every item, e.g. each plane or pattern of a loop.
+
+        Threads receive the items as is, FFTs they issue are limited to their share
+        of the cores. Processes require the function and items to be picklable.
+
+        Returns:
+            (list): results in the order of the items
+        """
+        self._check_open()
+        if self.kind == "serial":
+            return [func(item) for item in iterable]
+        elif self.kind == "threads":
+            workers = max(1, get_backend().workers // self.workers)
+            return list(self._threads().map(_limited(func, workers), iterable))
+        else:
+            return self._processes().map(func, iterable)
+
+    def xy(self, pupil, kz, z, support=None):
+        """
+        Maximum projection of each plane along the Y axis, see `Propagator.xy`.
+
+        Args:
+            pupil (np.ndarray): pupil field after the spatial filter
+            kz (np.ndarray): axial wave number of the pupil, shared with the workers
+                once and reused while the same array is passed
+            z (np.ndarray): defocus in microns
+            support (Support, optional): where the pupil is non-zero, e.g. support
+                of the spatial filter, derived once from the pupil if not provided
+        """
+        self._check_open()
+        z = np.asarray(z)
+        support = _pupil_support(pupil, support)
+        if self.kind == "serial":
+            return Propagator(pupil, kz, self.memory, support).xy(z)
+
+        memory, chunks = self._split(pupil, kz, z)
+        if self.kind == "threads":
+            # arrays are shared in-process as is
+            profiles = self.map(
+                lambda zc: Propagator(pupil, kz, memory, support).xy(zc), chunks
+            )
+        else:
+            profiles = self._scatter(_xy_worker, pupil, kz, support, memory, chunks)
+        return np.concatenate(profiles)
+
+    def volume(self, pupil, kz, z, path=None, reductions=REDUCTIONS, support=None):
+        """
+        Excitation volume reduced on the fly, see `Propagator.volume`. Workers write
+        their planes directly to the memory-mapped volume.
+
+        Args:
+            pupil (np.ndarray): pupil field after the spatial filter
+            kz (np.ndarray): axial wave number of the pupil
+            z (np.ndarray): defocus in microns
+            path (str, optional): .npy file to stream the volume to
+            reductions (tuple of str, optional): reductions to evaluate
+            support (Support, optional): where the pupil is non-zero, see `xy`
+
+        Returns:
+            (dict): requested reductions, and the read-only memory-mapped volume as
+                "volume" if it is streamed to disk
+        """
+        self._check_open()
+        z = np.asarray(z)
+        support = _pupil_support(pupil, support)
+        out = None
+        if path is not None:
+            shape = (z.size,) + pupil.shape
+            out = np.lib.format.open_memmap(path, "w+", kz.dtype, shape)
+            logger.info(f'streaming volume {shape} to "{path}"')
+
+        if self.kind == "serial":
+            propagator = Propagator(pupil, kz, self.memory, support)
+            results = propagator.volume(z, out=out, reductions=reductions)
+        else:
+            memory, chunks = self._split(pupil, kz, z)
+            offsets = np.cumsum([0] + [zc.size for zc in chunks])
+            if self.kind == "threads":
+
+                def volume(args):
+                    start, zc = args
+                    out_c = None if out is None else out[start : start + zc.size]
+                    propagator = Propagator(pupil, kz, memory, support)
+                    return propagator.volume(zc, out=out_c, reductions=reductions)
+
+                parts = self.map(volume, zip(offsets, chunks))
+            else:
+                chunks = [
+                    (start, zc, path, reductions) for start, zc in zip(offsets, chunks)
+                ]
+                parts = self._scatter(
+                    _volume_worker, pupil, kz, support, memory, chunks
+                )
+            results = _merge_reductions(parts)
+
+        if out is not None:
+            out.flush()
+            del out
+            results["volume"] = np.load(path, mmap_mode="r")
+        return results
+
+    ##
+
+    def _check_open(self):
+        if self.closed:
+            raise RuntimeError(f"{self.kind} executor is closed")
+
+    def _processes(self):
+        self._check_open()
+        if self._pool is None:
+            backend = get_backend().name
+            logger.info(f"spawning {self.workers} worker process(es)")
+            self._pool = Pool(
+                self.workers, initializer=_init_worker, initargs=(backend,)
+            )
+        return self._pool
+
+    def _scatter(self, func, pupil, kz, support, memory, chunks):
+        """
+        Distribute chunks of work over the worker processes. Grids and the support
+        index are shared once and reused while the same arrays are passed.
+
+        Returns:
+            (list): results in the order of the chunks
+        """
+        pool = self._processes()
+        kz, index = self._share(kz), self._share(support.index)
+        with SharedArray.copy(pupil) as pupil:
+            tasks = [
+                (i, pupil.handle, kz.handle, index.handle, memory, chunk)
+                for i, chunk in enumerate(chunks)
+            ]
+            results = list(tqdm(pool.imap_unordered(func, tasks), total=len(tasks)))
+        results.sort(key=lambda result: result[0])
+        return [result for _, result in results]
+
+    def _share(self, array, n_cached=4):
+        """Copy an array to shared memory, unless it is already shared."""
+        key = id(array)
+        try:
+            self._grids.move_to_end(key)
+        except KeyError:
+            # keep a reference to the array, so its id is not reused
+            self._grids[key] = (array, SharedArray.copy(array))
+            while len(self._grids) > n_cached:
+                _, (_, shared) = self._grids.popitem(last=False)
+                shared.close()
+        return self._grids[key][1]
+
+    def _split(self, pupil, kz, z):
+        """
+        Split defocus into chunks, at least one chunk per worker, and each chunk
+        still fits the budget of a worker.
+
+        Returns:
+            (tuple): memory budget of a worker, list of chunks
+        """
+        memory = max(1, self.memory // self.workers)
+        n = Propagator(pupil, kz, memory=memory).chunk_size
+        n_chunks = max(-(-z.size // n), min(self.workers, z.size))
+        return memory, np.array_split(z, n_chunks)
+
+    def _threads(self):
+        self._check_open()
+        if self._pool is None:
+            logger.info(f"spawning {self.workers} worker thread(s)")
+            self._pool = ThreadPoolExecutor(self.workers)
+        return self._pool
+
+
+def _pupil_support(pupil, support):
+    """Support of the pupil, evaluated once and shared by all the chunks."""
+    if support is None:
+        support = Support(pupil.shape, np.flatnonzero(pupil))
+        logger.debug(f"pupil support has {len(support)} element(s)")
+    return support
+
+
+def _limited(func, workers):
+    """Wrap a function to use at most the given number of FFT threads."""
+
+    def wrapped(item):
+        with set_workers(workers):
+            return func(item)
+
+    return wrapped
+
+
+## worker
+
+_attached = OrderedDict()  # name -> shared array
+
+
+def _init_worker(backend):
+    # parallelism comes from the pool, FFTs stay single-threaded
+    set_backend(backend, workers=1)
+
+
+def _attach(handle, n_cached=4):
+    """Attach to a shared array, recently used blocks stay attached."""
+    name = handle[-1]
+    try:
+        _attached.move_to_end(name)
+    except KeyError:
+        _attached[name] = SharedArray(*handle)
+        while len(_attached) > n_cached:
+            _, shared = _attached.popitem(last=False)
+            shared.close()
+    return _attached[name].array
+
+
+def _propagator(pupil, kz, index, memory):
+    pupil = _attach(pupil)
+    support = Support(pupil.shape, _attach(index))
+    return Propagator(pupil, _attach(kz), memory, support)
+
+
+def _xy_worker(args):
+    i, pupil, kz, index, memory, z = args
+    return i, _propagator(pupil, kz, index, memory).xy(z)
+
+
+def _volume_worker(args):
+    i, pupil, kz, index, memory, (start, z, path, reductions) = args
+    out = None
+    if path is not None:
+        out = np.load(path, mmap_mode="r+")[start : start + z.size]
+    propagator = _propagator(pupil, kz, index, memory)
+    results = propagator.volume(z, out=out, reductions=reductions)
+    if out is not None:
+        out.flush()
+    return i, results
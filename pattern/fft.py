@@ -0,0 +1,553 @@
+"""
+FFT backend shared by the entire package.
+
+The backend is selected by `set_backend`, or by the environment variables
+PATTERN_FFT_BACKEND ("scipy", "numpy" or "pyfftw") and PATTERN_FFT_WORKERS
+(number of threads, -1 for all the cores) upon import. pyFFTW wisdom is persisted
+to PATTERN_FFTW_WISDOM if it is set.
+"""
+
+import atexit
+from contextlib import contextmanager
+from functools import lru_cache
+import logging
+import os
+import pickle
+import threading
+
+import numpy as np
+
+__all__ = [
+    "fft2",
+    "ifft2",
+    "fftn",
+    "ifftn",
+    "rfft2",
+    "irfft2",
+    "cfft2",
+    "rcfft2",
+    "cdft_matrix",
+    "zoom_cfft",
+    "zoom_cfft2",
+    "shift_factors",
+    "fftshift",
+    "ifftshift",
+    "next_fast_len",
+    "get_backend",
+    "set_backend",
+    "set_workers",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class Backend(object):
+    """
+    Base class of FFT implementations.
+
+    Args:
+        workers (int, optional): number of threads, -1 to use all the cores
+    """
+
+    name = None
+
+    def __init__(self, workers=-1):
+        if workers is None or workers < 0:
+            workers = os.cpu_count()
+        self._workers = workers
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, workers={self.workers}>"
+
+    ##
+
+    @property
+    def workers(self):
+        """Number of threads, unless it is overridden in the calling thread."""
+        return getattr(_local, "workers", self._workers)
+
+    ##
+
+    def fftn(self, x, axes=None, overwrite_x=False):
+        raise NotImplementedError
+
+    def ifftn(self, x, axes=None, overwrite_x=False):
+        raise NotImplementedError
+
+    def rfftn(self, x, axes=None):
+        raise NotImplementedError
+
+    def irfftn(self, x, s=None, axes=None):
+        raise NotImplementedError
+
+    def next_fast_len(self, n):
+        from scipy.fft import next_fast_len
+
+        return next_fast_len(n)
+
+
+class ScipyBackend(Backend):
+    """scipy.fft, multithreaded and keeps single precision intact."""
+
+    name = "scipy"
+
+    def __init__(self, workers=-1):
+        super().__init__(workers)
+
+        import scipy.fft
+
+        self._fft = scipy.fft
+
+    ##
+
+    def fftn(self, x, axes=None, overwrite_x=False):
+        return self._fft.fftn(
+            x, axes=axes, overwrite_x=overwrite_x, workers=self.workers
+        )
+
+    def ifftn(self, x, axes=None, overwrite_x=False):
+        return self._fft.ifftn(
+            x, axes=axes, overwrite_x=overwrite_x, workers=self.workers
+        )
+
+    def rfftn(self, x, axes=None):
+        return self._fft.rfftn(x, axes=axes, workers=self.workers)
+
+    def irfftn(self, x, s=None, axes=None):
+        return self._fft.irfftn(x, s=s, axes=axes, workers=self.workers)
+
+
+class NumpyBackend(Backend):
+    """numpy.fft, single-threaded reference implementation."""
+
+    name = "numpy"
+
+    def __init__(self, workers=-1):
+        super().__init__(1)
+
+    ##
+
+    def fftn(self, x, axes=None, overwrite_x=False):
+        return np.fft.fftn(x, axes=axes)
+
+    def ifftn(self, x, axes=None, overwrite_x=False):
+        return np.fft.ifftn(x, axes=axes)
+
+    def rfftn(self, x, axes=None):
+        return np.fft.rfftn(x, axes=axes)
+
+    def irfftn(self, x, s=None, axes=None):
+        return np.fft.irfftn(x, s=s, axes=axes)
+
+
+class FFTWBackend(Backend):
+    """
+    pyFFTW, plans are cached in memory and accumulated wisdom is persisted to disk.
+
+    Args:
+        workers (int, optional): number of threads, -1 to use all the cores
+        wisdom (str, optional): path to the wisdom file
+    """
+
+    name = "pyfftw"
+
+    def __init__(self, workers=-1, wisdom=None):
+        super().__init__(workers)
+
+        try:
+            import pyfftw
+            import pyfftw.interfaces.scipy_fft
+        except ImportError:
+            raise RuntimeError('FFT backend "pyfftw" requires pyFFTW to be installed')
+        self._pyfftw = pyfftw
+        self._fft = pyfftw.interfaces.scipy_fft
+
+        # keep the FFTW objects alive between calls
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(300)
+
+        self._wisdom = wisdom
+        if wisdom:
+            self.load_wisdom(wisdom)
+            atexit.register(self.save_wisdom, wisdom)
+
+    ##
+
+    def load_wisdom(self, path):
+        try:
+            with open(path, "rb") as fd:
+                self._pyfftw.import_wisdom(pickle.load(fd))
+            logger.info(f'FFTW wisdom loaded from "{path}"')
+        except FileNotFoundError:
+            logger.debug(f'FFTW wisdom "{path}" does not exist')
+
+    def save_wisdom(self, path):
+        with open(path, "wb") as fd:
+            pickle.dump(self._pyfftw.export_wisdom(), fd)
+        logger.debug(f'FFTW wisdom saved to "{path}"')
+
+    ##
+
+    def fftn(self, x, axes=None, overwrite_x=False):
+        return self._fft.fftn(
+            x, axes=axes, overwrite_x=overwrite_x, workers=self.workers
+        )
+
+    def ifftn(self, x, axes=None, overwrite_x=False):
+        return self._fft.ifftn(
+            x, axes=axes, overwrite_x=overwrite_x, workers=self.workers
+        )
+
+    def rfftn(self, x, axes=None):
+        return self._fft.rfftn(x, axes=axes, workers=self.workers)
+
+    def irfftn(self, x, s=None, axes=None):
+        return self._fft.irfftn(x, s=s, axes=axes, workers=self.workers)
+
+    def next_fast_len(self, n):
+        return self._pyfftw.next_fast_len(n)
+
+
+_backends = {b.name: b for b in (ScipyBackend, NumpyBackend, FFTWBackend)}
+
+_backend = None
+
+_local = threading.local()  # per-thread overrides
+
+
+def get_backend():
+    """Current FFT backend."""
+    return _backend
+
+
+def set_backend(name="scipy", workers=-1, **kwargs):
+    """
+    Select the FFT backend used by the entire package.
+
+    Args:
+        name (str): "scipy", "numpy" or "pyfftw"
+        workers (int, optional): number of threads, -1 to use all the cores
+        **kwargs: backend specific options
+    """
+    global _backend
+
+    try:
+        klass = _backends[name]
+    except KeyError:
+        raise ValueError(f'unknown FFT backend "{name}"')
+    _backend = klass(workers, **kwargs)
+    logger.debug(f"FFT backend: {_backend}")
+
+    return _backend
+
+
+@contextmanager
+def set_workers(workers):
+    """
+    Override the number of FFT threads used by the calling thread, so transforms
+    issued from a thread pool do not oversubscribe the cores.
+
+    Args:
+        workers (int): number of threads, -1 to use all the cores
+    """
+    if workers is None or workers < 0:
+        workers = os.cpu_count()
+    previous = getattr(_local, "workers", None)
+    _local.workers = workers
+    try:
+        yield
+    finally:
+        if previous is None:
+            del _local.workers
+        else:
+            _local.workers = previous
+
+
+def _set_backend_from_env():
+    name = os.environ.get("PATTERN_FFT_BACKEND", "scipy")
+    try:
+        workers = int(os.environ.get("PATTERN_FFT_WORKERS", -1))
+    except ValueError as err:
+        logger.warning(f"invalid PATTERN_FFT_WORKERS, {err}, fallback to all the cores")
+        workers = -1
+    kwargs = dict()
+    if name == "pyfftw":
+        kwargs["wisdom"] = os.environ.get("PATTERN_FFTW_WISDOM", None)
+    try:
+        set_backend(name, workers, **kwargs)
+    except (ValueError, RuntimeError) as err:
+        logger.warning(f"{err}, fallback to scipy")
+        set_backend("scipy", workers)
+
+
+_set_backend_from_env()
+
+##
+
+
+def fft2(x, axes=(-2, -1), overwrite_x=False):
+    return _backend.fftn(x, axes=axes, overwrite_x=overwrite_x)
+
+
+def ifft2(x, axes=(-2, -1), overwrite_x=False):
+    return _backend.ifftn(x, axes=axes, overwrite_x=overwrite_x)
+
+
+def fftn(x, axes=None, overwrite_x=False):
+    return _backend.fftn(x, axes=axes, overwrite_x=overwrite_x)
+
+
+def ifftn(x, axes=None, overwrite_x=False):
+    return _backend.ifftn(x, axes=axes, overwrite_x=overwrite_x)
+
+
+def rfft2(x, axes=(-2, -1)):
+    return _backend.rfftn(x, axes=axes)
+
+
+def irfft2(x, s=None, axes=(-2, -1)):
+    return _backend.irfftn(x, s=s, axes=axes)
+
+
+def next_fast_len(n):
+    return _backend.next_fast_len(n)
+
+
+fftshift = np.fft.fftshift
+ifftshift = np.fft.ifftshift
+
+##
+
+
+def cfft2(x, axes=(-2, -1), overwrite_x=False, modulated=False, real=False):
+    """
+    Centered 2-D FFT, equivalent to `fftshift(fft2(ifftshift(x)))` without the
+    copies the shifts introduce. Shifts are folded into precomputed phase factors
+    instead, which reduce to a real checkerboard for even-sized axes.
+
+    Args:
+        x (np.ndarray): input array
+        axes (tuple of int, optional): axes to transform
+        overwrite_x (bool, optional): input can be used as scratch buffer
+        modulated (bool, optional): input is already multiplied by the pre-transform
+            factor from `shift_factors`
+        real (bool, optional): only the real part of the result is returned
+    """
+    x = np.asarray(x)
+    pre, post = shift_factors(x, axes)
+
+    if not modulated:
+        if overwrite_x and np.can_cast(np.result_type(x, pre), x.dtype, "same_kind"):
+            x = np.multiply(x, pre, out=x)
+        else:
+            x = np.multiply(x, pre)
+        overwrite_x = True
+    x = fft2(x, axes=axes, overwrite_x=overwrite_x)
+
+    if not real:
+        return np.multiply(x, post, out=x)
+    elif np.iscomplexobj(post):
+        result = x.real * post.real
+        result -= x.imag * post.imag
+        return result
+    else:
+        # real factors commute with the real part, skip the imaginary half
+        return np.multiply(x.real, post)
+
+
+def rcfft2(x, index=None):
+    """
+    Centered 2-D FFT of a real array over its last two axes, by `rfft2`. Only half of
+    the spectrum is transformed, the other half follows from Hermitian symmetry
+    X[-k] = conj(X[k]), and is only expanded where it is requested.
+
+    Both axes have to be even-sized, which keeps the modulated input real, otherwise
+    it falls back to `cfft2`.
+
+    Args:
+        x (np.ndarray): real input array
+        index (np.ndarray, optional): flat indices of the centered spectrum to
+            evaluate, e.g. support of a spatial filter, default to all
+
+    Returns:
+        (np.ndarray): spectrum of the shape of x, or of shape (..., len(index))
+    """
+    x = np.asarray(x)
+    ny, nx = x.shape[-2:]
+    if ny % 2 or nx % 2:
+        logger.debug(f"odd-sized ({ny}, {nx}), fallback to complex transform")
+        spectrum = cfft2(
+            x.astype(np.result_type(x.dtype, np.complex64)), overwrite_x=True
+        )
+        if index is not None:
+            spectrum = spectrum.reshape(x.shape[:-2] + (-1,))[..., index]
+        return spectrum
+
+    pre, post = shift_factors(x)
+    half = rfft2(x * pre)  # (..., ny, nx // 2 + 1)
+    h = half.shape[-1]
+
+    if index is None:
+        spectrum = np.empty(x.shape, half.dtype)
+        spectrum[..., :h] = half
+        # X[ky, kx] = conj(X[-ky, -kx]) for the columns rfft2 leaves out
+        flip = (-np.arange(ny)) % ny
+        np.conjugate(half[..., flip, nx - h : 0 : -1], out=spectrum[..., h:])
+        return np.multiply(spectrum, post, out=spectrum)
+
+    ky, kx = np.divmod(np.asarray(index), nx)
+    mirrored = kx >= h
+    # fold the left out columns onto their conjugate counterparts
+    ky = np.where(mirrored, (-ky) % ny, ky)
+    kx = np.where(mirrored, nx - kx, kx)
+    values = half[..., ky, kx]
+    np.conjugate(values, out=values, where=mirrored)
+    values *= post.reshape(-1)[index]
+    return values
+
+
+def cdft_matrix(n, index, dtype=np.complex64):
+    """
+    Rows of the centered DFT matrix, applying it along an axis evaluates only the
+    selected outputs of `cfft2` along that axis.
+
+    With s = n // 2, output u of an axis of size n is
+        sum_j x[j] * exp(-2j*pi*(j-s)*(u-s)/n)
+
+    Args:
+        n (int): size of the axis
+        index (array-like of int): outputs to evaluate
+        dtype (np.dtype, optional): data type of the matrix
+    """
+    return _cdft_matrix(n, tuple(int(u) for u in index), np.dtype(dtype))
+
+
+@lru_cache(maxsize=8)
+def _cdft_matrix(n, index, dtype):
+    s = n // 2
+    u, j = np.array(index) - s, np.arange(n) - s
+    # reduce the product modulo n to keep the phase accurate for large n
+    matrix = np.exp(-2j * np.pi * (np.outer(u, j) % n) / n).astype(dtype)
+    matrix.setflags(write=False)
+    return matrix
+
+
+def zoom_cfft(x, start, step, m, axis=-1):
+    """
+    Centered DFT along an axis evaluated at m evenly spaced outputs of arbitrary
+    origin and spacing, by the chirp-z transform (Bluestein's algorithm). Costs a
+    few FFTs of length about n + m instead of zero-padding the input.
+
+    With s = n // 2, output k is at q = start + k * step, in bins of `cfft2`
+    relative to its center,
+        sum_j x[j] * exp(-2j*pi*(j-s)*q/n)
+    start=-(n//2), step=1 and m=n reproduce `cfft2` along the axis.
+
+    Args:
+        x (np.ndarray): input array
+        start (float): position of the first output
+        step (float): spacing of the outputs
+        m (int): number of outputs
+        axis (int, optional): axis to transform
+    """
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    n = x.shape[-1]
+    dtype = np.result_type(x.dtype, np.complex64)
+    size = next_fast_len(n + m - 1)
+
+    def chirp(t, sign):
+        # exp(sign * 1j*pi*step*t^2/n), evaluated in double precision
+        t = np.asarray(t, np.float64)
+        return np.exp(sign * 1j * np.pi * step * (t * t) / n)
+
+    # modulate by the start offset and the chirp
+    j, k = np.arange(n), np.arange(m)
+    factor = np.exp(-2j * np.pi * start * j / n) * chirp(j, -1)
+    a = np.zeros(x.shape[:-1] + (size,), dtype)
+    np.multiply(x, factor.astype(dtype), out=a[..., :n])
+
+    # convolve with the conjugate chirp
+    b = np.zeros(size, np.complex128)
+    b[:m] = chirp(k, 1)
+    b[size - n + 1 :] = chirp(np.arange(-n + 1, 0), 1)
+    b = fftn(b.astype(dtype), axes=(-1,))
+
+    a = fftn(a, axes=(-1,), overwrite_x=True)
+    a *= b
+    a = ifftn(a, axes=(-1,), overwrite_x=True)[..., :m]
+
+    # demodulate, and shift the origin to the center of the input
+    q = start + k * step
+    a *= (chirp(k, -1) * np.exp(2j * np.pi * (n // 2) * q / n)).astype(dtype)
+    return np.moveaxis(a, -1, axis)
+
+
+def zoom_cfft2(x, ys, xs, axes=(-2, -1)):
+    """
+    Centered 2-D DFT evaluated over a region at arbitrary sampling, see
+    `zoom_cfft`.
+
+    Args:
+        x (np.ndarray): input array
+        ys (tuple): (start, step, m) of the outputs along the first axis
+        xs (tuple): (start, step, m) of the outputs along the second axis
+        axes (tuple of int, optional): axes to transform
+    """
+    x = zoom_cfft(x, *xs, axis=axes[1])
+    return zoom_cfft(x, *ys, axis=axes[0])
+
+
+def shift_factors(x, axes=(-2, -1)):
+    """
+    Pre/post-transform phase factors `cfft2` applies to x.
+
+    Args:
+        x (np.ndarray): input array
+        axes (tuple of int, optional): axes to transform
+    """
+    axes = tuple(a % x.ndim for a in axes)
+    shape = tuple(x.shape[a] if a in axes else 1 for a in range(x.ndim))
+    single = x.dtype in (np.float32, np.complex64)
+    return _shift_factors(shape, single)
+
+
+@lru_cache(maxsize=8)
+def _shift_factors(shape, single):
+    """
+    Pre/post-transform phase factors of a centered DFT.
+
+    With s = n // 2, `ifftshift` followed by the DFT and `fftshift` along an axis of
+    size n equals to modulating the input by exp(2j*pi*s*j/n) and the output by
+    exp(2j*pi*s*(k-s)/n), which are (-1)^j and (-1)^(k-s) when n is even.
+
+    Args:
+        shape (tuple of int): shape of the input, 1 for axes not transformed
+        single (bool): factors are used in single precision
+    """
+    pre, post = np.ones((1,) * len(shape)), np.ones((1,) * len(shape))
+    for axis, n in enumerate(shape):
+        if n == 1:
+            continue
+        s, j = n // 2, np.arange(n)
+        if n % 2 == 0:
+            a = 1.0 - 2.0 * (j % 2)
+            b = a if s % 2 == 0 else -a
+        else:
+            a = np.exp(2j * np.pi * s * j / n)
+            b = np.exp(2j * np.pi * s * (j - s) / n)
+        vshape = [1] * len(shape)
+        vshape[axis] = n
+        pre, post = pre * a.reshape(vshape), post * b.reshape(vshape)
+
+    if np.iscomplexobj(pre):
+        dtype = np.complex64 if single else np.complex128
+    else:
+        # exact, therefore single precision is sufficient
+        dtype = np.float32
+    pre, post = pre.astype(dtype), post.astype(dtype)
+    if np.array_equal(pre, post):
+        post = pre
+    for factor in (pre, post):
+        factor.setflags(write=False)
+
+    return pre, post
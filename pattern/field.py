@@ -1,28 +1,244 @@
+from collections import OrderedDict, namedtuple
+from functools import wraps
 import logging
 
 import numpy as np
-from scipy.fftpack import fft2, fftshift, ifftshift
 
+from pattern.fft import cfft2, next_fast_len
 from pattern.utils import field2intensity
 
 __all__ = ["Field"]
 
 logger = logging.getLogger(__name__)
 
+GridCacheInfo = namedtuple("GridCacheInfo", ["hits", "misses", "currsize", "nbytes"])
+
+
+class GridCache(object):
+    """
+    Store of coordinate grids derived from a field. Grids are shared between callers,
+    therefore they are frozen as read-only arrays, and the entire store is flushed
+    once the key it was built against changes.
+
+    Grids that depend on further parameters, e.g. the radii of an annulus, are
+    bounded, only the most recently used ones are kept.
+
+    Args:
+        max_bounded (int, optional): number of bounded grids to keep
+    """
+
+    def __init__(self, max_bounded=4):
+        self._key = None
+        self._grids, self._bounded = dict(), OrderedDict()
+        self._max_bounded = max_bounded
+        self._hits, self._misses = 0, 0
+
+    def __len__(self):
+        return len(self._grids) + len(self._bounded)
+
+    ##
+
+    @property
+    def nbytes(self):
+        grids = list(self._grids.values()) + list(self._bounded.values())
+        return sum(sum(a.nbytes for a in _as_tuple(grid)) for grid in grids)
+
+    ##
+
+    def clear(self):
+        self._key = None
+        self._grids, self._bounded = dict(), OrderedDict()
+
+    def info(self):
+        return GridCacheInfo(self._hits, self._misses, len(self), self.nbytes)
+
+    def lookup(self, key, name, func, bounded=False):
+        """
+        Retrieve grid by name, generate it by func if it does not exist.
+
+        Args:
+            key (tuple): parameters the grid depends on
+            name (str): name of the grid
+            func (callable): generate the grid
+            bounded (bool, optional): the least recently used grid is dropped when
+                there are more than `max_bounded` of them
+        """
+        if key != self._key:
+            if self._key is not None:
+                logger.debug(f"grid cache invalidated, {len(self)} grid(s) dropped")
+            self._grids, self._bounded = dict(), OrderedDict()
+            self._key = key
+
+        grids = self._bounded if bounded else self._grids
+        try:
+            grid = grids[name]
+            self._hits += 1
+        except KeyError:
+            logger.debug(f'grid cache miss "{name}"')
+            grid = func()
+            for a in _as_tuple(grid):
+                if isinstance(a, np.ndarray):
+                    a.setflags(write=False)
+            grids[name] = grid
+            self._misses += 1
+
+        if bounded:
+            grids.move_to_end(name)
+            while len(grids) > self._max_bounded:
+                dropped, _ = grids.popitem(last=False)
+                logger.debug(f'grid cache dropped "{dropped}"')
+        return grid
+
+
+class Support(object):
+    """
+    Sparse subset of the frequency domain, described by sorted flat indices.
+
+    Args:
+        shape (tuple of int): shape of the dense domain
+        index (np.ndarray): flat indices that belong to the support
+    """
+
+    def __init__(self, shape, index):
+        self._shape = tuple(shape)
+        self._index = index
+        self._index.setflags(write=False)
+
+        self._coordinates = None
+
+    def __len__(self):
+        return self.index.size
+
+    ##
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def nbytes(self):
+        return self.index.nbytes
+
+    @property
+    def shape(self):
+        return self._shape
+
+    ##
+
+    def coordinates(self):
+        """Row and column index of each element."""
+        if self._coordinates is None:
+            self._coordinates = np.unravel_index(self.index, self.shape)
+            for a in self._coordinates:
+                a.setflags(write=False)
+        return self._coordinates
+
+    def gather(self, array):
+        """Values of a dense array on the support."""
+        return array.reshape(-1)[self.index]
+
+    def remap(self, values, support):
+        """
+        Transfer values defined on another support to this one, elements that are
+        missing from the other support are zeros.
+
+        Args:
+            values (np.ndarray): values on the other support
+            support (Support): support the values are defined on
+        """
+        if support is self:
+            return values
+        result = np.zeros(len(self), values.dtype)
+        pos = np.searchsorted(self.index, support.index)
+        inside = pos < len(self)
+        inside[inside] = self.index[pos[inside]] == support.index[inside]
+        result[pos[inside]] = values[inside]
+        return result
+
+    def scatter(self, values, out=None):
+        """
+        Place values into a dense array, zeros outside of the support.
+
+        Args:
+            values (np.ndarray): values on the support
+            out (np.ndarray, optional): dense array to write into
+        """
+        if out is None:
+            out = np.zeros(self.shape, values.dtype)
+        else:
+            out.fill(0)
+        if out.flags.c_contiguous:
+            out.reshape(-1)[self.index] = values
+        else:
+            # reshape would copy and lose the write
+            out[self.coordinates()] = values
+        return out
+
+    def union(self, other):
+        if other is self:
+            return self
+        return Support(self.shape, np.union1d(self.index, other.index))
+
+
+def _as_tuple(grid):
+    return grid if isinstance(grid, tuple) else (grid,)
+
+
+def _grid_vector(n):
+    """Pixel index of a grid of size n, centered at 0."""
+    return np.linspace(-(n - 1) / 2.0, (n - 1) / 2.0, n)
+
+
+def _row_blocks(shape, itemsize=8, nbytes=1 << 22):
+    """Split rows of a 2-D array into slices of approximately nbytes each."""
+    ny, nx = shape
+    step = max(1, nbytes // (nx * itemsize))
+    for start in range(0, ny, step):
+        yield slice(start, min(start + step, ny))
+
+
+def cached_grid(func):
+    """Memoize a grid generator of Field in its grid cache."""
+
+    @wraps(func)
+    def wrapper(self):
+        return self._grids.lookup(self._grid_key(), func.__name__, lambda: func(self))
+
+    return wrapper
+
 
 class Field(object):
     """
-    Field describes how the final product is formed, including system specification and 
+    Field describes how the final product is formed, including system specification and
     physical spatial filters.
-    
+
     Args:
         slm (SLM): the SLM used in the system
         obj (Objective): the objective that face toward the sample
         wavelength (float): excitation wavelength in microns
         mag (float): system magnification
+        shape (tuple of int, optional): shape of the field, default to SLM shape
+        domain (str, optional): working domain the field is padded to,
+            "square" (max(shape) x max(shape), default), "rect" (shape as is) or
+            "fast" (each axis padded to a fast FFT length)
+        dtype (np.dtype, optional): real precision of the grids, templates and
+            transforms, np.float32 (default) or np.float64 as reference
+        spectrum (str, optional): representation of the op templates and masks in
+            frequency space, "dense" (default) or "sparse", which only keeps the
+            coefficients on their annular support
     """
 
-    def __init__(self, slm, obj, wavelength, mag, shape=None):
+    def __init__(
+        self,
+        slm,
+        obj,
+        wavelength,
+        mag,
+        shape=None,
+        domain="square",
+        dtype=np.float32,
+        spectrum="dense",
+    ):
         self._slm, self._obj = slm, obj
         self._wavelength = wavelength
 
@@ -30,14 +246,64 @@ class Field(object):
 
         self._shape = shape if shape else slm.shape
 
+        if domain not in ("square", "rect", "fast"):
+            raise ValueError(f'unknown working domain "{domain}"')
+        self._domain = domain
+
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError(f'unsupported precision "{dtype}"')
+        self._dtype = dtype
+
+        if spectrum not in ("dense", "sparse"):
+            raise ValueError(f'unknown spectrum representation "{spectrum}"')
+        self._spectrum = spectrum
+
         self._ops = []
 
+        self._grids = GridCache()
+
+    def __repr__(self):
+        ops = ", ".join(repr(op) for op in self.ops)
+        return (
+            f"<{self.__class__.__name__}, slm={self.slm!r}, obj={self.objective!r}, "
+            f"wavelength={self.wavelength!r}, mag={self.mag!r}, "
+            f"shape={tuple(self.shape)}, domain={self.domain}, dtype={self.dtype}, "
+            f"spectrum={self.spectrum}, ops=[{ops}]>"
+        )
+
     ##
 
     @property
     def shape(self):
         return self._shape
 
+    @property
+    def complex_dtype(self):
+        """Complex counterpart of the working precision."""
+        return np.result_type(self.dtype, np.complex64)
+
+    @property
+    def domain(self):
+        """Working domain type."""
+        return self._domain
+
+    @property
+    def domain_shape(self):
+        """Shape of the padded working domain all the transforms operate on."""
+        if self.domain == "square":
+            n = max(*self.shape)
+            return (n, n)
+        elif self.domain == "rect":
+            return tuple(self.shape)
+        else:
+            return tuple(next_fast_len(n) for n in self.shape)
+
+    @property
+    def dtype(self):
+        """Real working precision."""
+        return self._dtype
+
     @property
     def mag(self):
         """System overall magnification."""
@@ -55,57 +321,134 @@ class Field(object):
     def slm(self):
         return self._slm
 
+    @property
+    def spectrum(self):
+        """Representation of the templates in frequency space."""
+        return self._spectrum
+
     @property
     def wavelength(self):
         return self._wavelength
 
     ##
 
-    def cartesian_r(self):
-        # effective pixel size
-        dy, dx = self.slm.pixel_size
-        dx /= self.mag
-        dy /= self.mag
-        # grid vector
-        n = max(*self.shape)
-        v = np.linspace(-(n - 1) / 2.0, (n - 1) / 2.0, n)
-        vx, vy = v * dx, v * dy
-        # grid
-        return np.meshgrid(vy, vx, indexing="ij")
+    def grid_cache_info(self):
+        """Hit/miss statistics of the coordinate grid cache."""
+        return self._grids.info()
 
+    def clear_grid_cache(self):
+        self._grids.clear()
+
+    def cartesian_r(self, sparse=False):
+        """
+        Real space coordinates.
+
+        Args:
+            sparse (bool, optional): return open grids that broadcast against each
+                other instead of the full grids, similar to `np.ogrid`
+        """
+        gy, gx = self._open_r()
+        return (gy, gx) if sparse else tuple(np.broadcast_arrays(gy, gx))
+
+    @cached_grid
     def polar_r(self):
-        gy, gx = self.cartesian_r()
+        gy, gx = self._open_r()
         return np.hypot(gx, gy)
 
-    def cartesian_k(self):
-        # effective pixel size
-        dy, dx = self.slm.pixel_size
-        dx /= self.mag
-        dy /= self.mag
-        # effective resolution unit
-        n = max(*self.shape)
-        dkx = 2 * np.pi / n / dx
-        dky = 2 * np.pi / n / dy
-        # grid vector
-        v = np.linspace(-(n - 1) / 2.0, (n - 1) / 2.0, n)
-        vkx, vky = v * dkx, v * dky
-        # grid
-        return np.meshgrid(vky, vkx, indexing="ij")
+    def cartesian_k(self, sparse=False):
+        """
+        Frequency space coordinates.
+
+        Args:
+            sparse (bool, optional): return open grids that broadcast against each
+                other instead of the full grids, similar to `np.ogrid`
+        """
+        gky, gkx = self._open_k()
+        return (gky, gkx) if sparse else tuple(np.broadcast_arrays(gky, gkx))
 
+    @cached_grid
     def polar_k(self):
-        gky, gkx = self.cartesian_k()
+        gky, gkx = self._open_k()
         return np.hypot(gkx, gky)
 
+    @cached_grid
     def kz(self):
-        gr = self.polar_k()
-        kz2 = np.square(2 * np.pi / self.wavelength) - np.square(gr)
-        n_neg = len(kz2 < 0)
+        gky, gkx = self._open_k()
+        kz = np.square(gky) + np.square(gkx)
+        np.subtract(self.dtype.type(2 * np.pi / self.wavelength) ** 2, kz, out=kz)
+        n_neg = np.count_nonzero(kz < 0)
         if n_neg > 0:
             logger.warning(
                 f"SLM total area exceeds annulus confinement ({n_neg} element(s))"
             )
-        kz2[kz2 < 0] = 0
-        kz = np.sqrt(kz2)
+        np.maximum(kz, 0, out=kz)
+        np.sqrt(kz, out=kz)
+        return kz
+
+    def annulus(self, k_in, k_out):
+        """
+        Annular support in frequency space, k_in < |k| < k_out.
+
+        The radius is evaluated block by block from the open grids, therefore the
+        full radial grid is never materialized.
+
+        Args:
+            k_in (float): inner radius
+            k_out (float): outer radius
+        """
+
+        def generate():
+            gky, gkx = self._open_k()
+            annulus = np.empty((gky.size, gkx.size), np.bool_)
+            for rows in _row_blocks(annulus.shape):
+                kr = np.hypot(gkx, gky[rows])
+                annulus[rows] = (kr > k_in) & (kr < k_out)
+            return annulus
+
+        return self._grids.lookup(
+            self._grid_key(), f"annulus({k_in!r}, {k_out!r})", generate, bounded=True
+        )
+
+    def annulus_support(self, k_in, k_out):
+        """
+        Sparse counterpart of `annulus`, the dense mask is never materialized.
+
+        Args:
+            k_in (float): inner radius
+            k_out (float): outer radius
+        """
+
+        def generate():
+            gky, gkx = self._open_k()
+            shape = (gky.size, gkx.size)
+            index = []
+            for rows in _row_blocks(shape):
+                kr = np.hypot(gkx, gky[rows])
+                index.append(
+                    np.flatnonzero((kr > k_in) & (kr < k_out)) + rows.start * shape[1]
+                )
+            return Support(shape, np.concatenate(index))
+
+        return self._grids.lookup(
+            self._grid_key(),
+            f"annulus_support({k_in!r}, {k_out!r})",
+            generate,
+            bounded=True,
+        )
+
+    def sample_kz(self, support):
+        """
+        Evaluate kz on a sparse support only.
+
+        Args:
+            support (Support): where to evaluate
+        """
+        gky, gkx = self._open_k()
+        iy, ix = support.coordinates()
+        kz = np.square(gky[iy, 0]) + np.square(gkx[0, ix])
+        np.subtract(self.dtype.type(2 * np.pi / self.wavelength) ** 2, kz, out=kz)
+        np.maximum(kz, 0, out=kz)
+        np.sqrt(kz, out=kz)
         return kz
 
     ##
@@ -130,7 +473,7 @@ class Field(object):
         imshow(None, slm_pattern[self._roi()], cmap="binary")
 
         # mask
-        pupil_field_bl_pre = fftshift(fft2(ifftshift(slm_field_bl)))
+        pupil_field_bl_pre = cfft2(slm_field_bl, overwrite_x=True)
         pre_mask = field2intensity(pupil_field_bl_pre)
         pupil_field_bl_post = self.mask(pupil_field_bl_pre)
         post_mask = field2intensity(pupil_field_bl_post)
@@ -149,7 +492,7 @@ class Field(object):
         slm_field_ideal = self.slm_field_ideal()
         ideal = field2intensity(slm_field_ideal)
 
-        obj_field = fftshift(fft2(ifftshift(pupil_field_bl_post)))
+        obj_field = cfft2(pupil_field_bl_post)
         bl = field2intensity(obj_field)
 
         # REMOVE
@@ -166,7 +509,7 @@ class Field(object):
         # for i, iz in enumerate(z):
         #    print(f"{i}, z={iz}um")
         #    field = pupil_field_bl_post * np.exp(1j * kz * iz)
-        #    field = fftshift(fft2(ifftshift(field)))
+        #    field = cfft2(field, overwrite_x=True)
         #    intensity = field2intensity(field)
         #    axial[:, i] = intensity[:, intensity.shape[1] // 2]
 
@@ -195,9 +538,48 @@ class Field(object):
 
     ##
 
+    def _grid_key(self):
+        """Parameters the coordinate grids depend on."""
+        return (
+            tuple(self.slm.pixel_size),
+            self.mag,
+            self.domain_shape,
+            self.wavelength,
+            self.dtype,
+        )
+
+    @cached_grid
+    def _open_r(self):
+        # effective pixel size
+        dy, dx = self.slm.pixel_size
+        dx /= self.mag
+        dy /= self.mag
+        # grid vector
+        ny, nx = self.domain_shape
+        vx = (_grid_vector(nx) * dx).astype(self.dtype)
+        vy = (_grid_vector(ny) * dy).astype(self.dtype)
+        # open grid
+        return vy[:, np.newaxis], vx[np.newaxis, :]
+
+    @cached_grid
+    def _open_k(self):
+        # effective pixel size
+        dy, dx = self.slm.pixel_size
+        dx /= self.mag
+        dy /= self.mag
+        # effective resolution unit, each axis has its own sampling
+        ny, nx = self.domain_shape
+        dkx = 2 * np.pi / nx / dx
+        dky = 2 * np.pi / ny / dy
+        # grid vector
+        vkx = (_grid_vector(nx) * dkx).astype(self.dtype)
+        vky = (_grid_vector(ny) * dky).astype(self.dtype)
+        # open grid
+        return vky[:, np.newaxis], vkx[np.newaxis, :]
+
     def _roi(self):
         ny0, nx0 = self.slm.shape
-        n = max(*self.shape)
-        ox, oy = (n - nx0) // 2, (n - ny0) // 2
+        ny, nx = self.domain_shape
+        ox, oy = (nx - nx0) // 2, (ny - ny0) // 2
         logger.debug(f"roi offset, ox:{ox}, oy:{oy}")
         return slice(oy, oy + ny0), slice(ox, ox + nx0)
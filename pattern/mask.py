@@ -13,9 +13,15 @@ logger = logging.getLogger(__name__)
 class Mask(ABC):
     def __init__(self):
         self._mask = None
+        self._support = None
 
     def __call__(self, field):
-        field *= self.mask
+        if self.support is None:
+            field *= self.mask
+        else:
+            # only values on the support survive, move them instead of multiplying
+            values = self.support.gather(field)
+            self.support.scatter(values, out=field)
         return field
 
     ##
@@ -24,6 +30,11 @@ class Mask(ABC):
     def mask(self):
         return self._mask
 
+    @property
+    def support(self):
+        """Sparse support of a binary mask, None if the mask is dense."""
+        return self._support
+
     ##
 
     def calibrate(self, field):
@@ -36,6 +47,9 @@ class AnnularMask(Mask):
         self._d_out, self._d_in = d_out, d_in
         self._na_out, self._na_in = None, None
 
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, d_out={self.d_out!r}, d_in={self.d_in!r}>"
+
     ##
 
     @property
@@ -49,7 +63,9 @@ class AnnularMask(Mask):
     @property
     def mask(self):
         if self._mask is None:
-            raise RuntimeError("please calibrate the mask by a field first")
+            if self._support is None:
+                raise RuntimeError("please calibrate the mask by a field first")
+            self._mask = self._support.scatter(np.ones(len(self._support), np.bool_))
         return self._mask
 
     @property
@@ -74,6 +90,7 @@ class AnnularMask(Mask):
         id_na = c * self.na_in
 
         # generate pupil mask
-        mask = field.polar_k()
-        self._mask = (mask > id_na) & (mask < od_na)
-
+        if field.spectrum == "sparse":
+            self._mask, self._support = None, field.annulus_support(id_na, od_na)
+        else:
+            self._mask, self._support = field.annulus(id_na, od_na), None
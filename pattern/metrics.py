@@ -0,0 +1,168 @@
+"""
+Quality metrics of binary phase patterns.
+
+All the metrics of a pattern share its filtered spectrum, and each of them only
+evaluates the transforms it needs:
+
+- "passthrough", fraction of power through the spatial filter. The pattern has unit
+  modulus, so its total power is known by Parseval's theorem and only the spectrum
+  on the filter support is summed.
+- "side_lobe", peak of the side lobes relative to the main lobe of the dithered
+  profile along Y. Dithering averages along X, whose sum of intensity only needs a
+  1-D transform along Y by Parseval's theorem.
+- "uniformity", minimum over maximum of the profile along X within the field of
+  view, only needs a 1-D transform along X.
+- "similarity", squared error between the peak-normalized intensities of the
+  excitation and of the ideal field, needs the full 2-D transform.
+"""
+
+import logging
+
+import numpy as np
+
+from .fft import cfft2, rcfft2
+
+__all__ = ["METRICS", "evaluate"]
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("passthrough", "side_lobe", "uniformity", "similarity")
+
+
+def evaluate(
+    patterns,
+    mask,
+    metrics=METRICS,
+    target=None,
+    fov=0.5,
+    dtype=np.complex64,
+    memory=1 << 29,
+):
+    """
+    Evaluate metrics of binary phase patterns.
+
+    Args:
+        patterns (np.ndarray): binary patterns over the working domain, of shape
+            (ny, nx) or (n, ny, nx)
+        mask (Mask): spatial filter, calibrated to the field of the patterns
+        metrics (tuple of str, optional): metrics to evaluate
+        target (np.ndarray, optional): peak-normalized ideal intensity, required by
+            "similarity"
+        fov (float, optional): central fraction along X where "uniformity" applies
+        dtype (np.dtype, optional): complex precision of the transforms
+        memory (int, optional): memory budget of a batch in bytes
+
+    Returns:
+        (dict): array of each requested metric, one value per pattern
+    """
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"unknown metric(s) {sorted(unknown)}")
+    if "similarity" in metrics and target is None:
+        raise ValueError('"similarity" requires the ideal intensity')
+
+    patterns = np.asarray(patterns)
+    if patterns.ndim == 2:
+        results = evaluate(
+            patterns[np.newaxis], mask, metrics, target, fov, dtype, memory
+        )
+        return {metric: values[0] for metric, values in results.items()}
+    n, ny, nx = patterns.shape
+    results = {metric: np.empty(n) for metric in metrics}
+
+    dtype = np.dtype(dtype)
+    real = np.finfo(dtype).dtype
+    # the real +/-1 fields and their half spectra, or the filtered pupils
+    batch = max(1, memory // (2 * ny * nx * dtype.itemsize))
+
+    # two 1-D transforms cost as much as the full one
+    full = "similarity" in metrics or {"side_lobe", "uniformity"} <= set(metrics)
+    partial = not full and bool({"side_lobe", "uniformity"} & set(metrics))
+    need_field = full or partial
+    transform = "2-D" if full else "1-D" if partial else "none"
+    logger.debug(f"evaluate {n} pattern(s), transform: {transform}")
+
+    for start in range(0, n, batch):
+        chunk = patterns[start : start + batch]
+
+        # exp(1j * pi * pattern) is -1 where the pattern is set, 1 elsewhere
+        fields = np.where(chunk, real.type(-1), real.type(1))
+
+        if mask.support is None:
+            spectra = rcfft2(fields)
+            spectra *= mask.mask
+            values = spectra.reshape(len(chunk), -1)
+        else:
+            # only the spectrum on the filter support survives, and is all that is
+            # expanded from the half spectrum
+            spectra = None
+            values = rcfft2(fields, index=mask.support.index)
+        del fields
+        if "passthrough" in metrics:
+            # Parseval, total power of a unit modulus field is (ny * nx) ** 2
+            power = _abs2(values).sum(axis=1, dtype=np.float64)
+            results["passthrough"][start : start + len(chunk)] = power / (ny * nx) ** 2
+        if not need_field:
+            continue
+
+        pupils = spectra
+        if pupils is None:
+            pupils = np.zeros((len(chunk), ny * nx), values.dtype)
+            pupils[:, mask.support.index] = values
+            pupils = pupils.reshape(chunk.shape)
+
+        if full:
+            fields = cfft2(pupils, overwrite_x=True)
+            intensity = _abs2(fields)
+            profile_y = intensity.sum(axis=2, dtype=np.float64)
+            profile_x = intensity.sum(axis=1, dtype=np.float64)
+        elif "side_lobe" in metrics:
+            # sum along X of |F|^2 equals the sum along kx of the 1-D transform
+            profile_y = _abs2(cfft2(pupils, axes=(-2,), overwrite_x=True)).sum(
+                axis=2, dtype=np.float64
+            )
+        else:
+            profile_x = _abs2(cfft2(pupils, axes=(-1,), overwrite_x=True)).sum(
+                axis=1, dtype=np.float64
+            )
+
+        for i in range(len(chunk)):
+            j = start + i
+            if "side_lobe" in metrics:
+                results["side_lobe"][j] = _side_lobe_ratio(profile_y[i])
+            if "uniformity" in metrics:
+                results["uniformity"][j] = _uniformity(profile_x[i], fov)
+            if "similarity" in metrics:
+                error = intensity[i] / intensity[i].max()
+                error -= target
+                results["similarity"][j] = np.square(error).sum(dtype=np.float64)
+
+    return results
+
+
+def _abs2(field):
+    """Squared modulus of a complex field."""
+    intensity = np.square(field.real)
+    intensity += np.square(field.imag)
+    return intensity
+
+
+def _side_lobe_ratio(profile):
+    """Highest side lobe relative to the peak, the main lobe ends at its minima."""
+    peak = int(np.argmax(profile))
+    # first local minimum on each side of the peak
+    rising = np.flatnonzero(np.diff(profile[peak:]) > 0)
+    stop = peak + rising[0] if rising.size else profile.size - 1
+    falling = np.flatnonzero(np.diff(profile[: peak + 1]) < 0)
+    start = falling[-1] + 1 if falling.size else 0
+
+    side = max(profile[:start].max(initial=0), profile[stop + 1 :].max(initial=0))
+    return side / profile[peak]
+
+
+def _uniformity(profile, fov):
+    """Minimum over maximum of the central part of a profile."""
+    n = profile.size
+    half = max(1, int(n * fov) // 2)
+    center = profile[n // 2 - half : n // 2 + half]
+    return center.min() / center.max()
@@ -10,6 +10,12 @@ class Objective(object):
         self._mag, self._na, self._f_tube = mag, na, f_tube
         self._ri = ri
 
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}, mag={self.mag!r}, na={self.na!r}, "
+            f"f_tube={self.f_tube!r}, ri={self.ri!r}>"
+        )
+
     ##
 
     @property
@@ -1,8 +1,9 @@
 from abc import ABC, abstractmethod
+from hashlib import sha256
+import inspect
 import logging
 
 import numpy as np
-from tqdm import tqdm
 
 from .field import Field
 
@@ -12,14 +13,54 @@ logger = logging.getLogger(__name__)
 
 
 class Op(ABC):
+    """
+    Operation that contributes to the ideal field in frequency space.
+
+    Templates are only regenerated by `refresh` when parameters of the op, or the
+    field it was built against, have changed. Applying the op to a field always
+    regenerates it. Each regeneration bumps the op version.
+    """
+
+    # how the template combines with the proposed field, "add" or "multiply"
+    mode = None
+
+    def __init__(self):
+        self._version = 0
+        self._built = None
+
     def __call__(self, field: Field):
         assert isinstance(field, Field), "Ops can only apply register with a Field"
         field.register_op(self)
 
-        self.update(field)
+        self.refresh(field, force=True)
 
         return field
 
+    def __repr__(self):
+        return f"<{self.__class__.__name__}, {self._parameters()}>"
+
+    ##
+
+    @property
+    def dirty(self):
+        """Parameters are modified since last update."""
+        return self._built is None
+
+    @property
+    def support(self):
+        """Sparse support the template is defined on, None if it is dense."""
+        return None
+
+    @property
+    def template(self):
+        """Template the op applies to a proposed field."""
+        raise NotImplementedError
+
+    @property
+    def version(self):
+        """Revision of the template."""
+        return self._version
+
     ##
 
     @abstractmethod
@@ -27,25 +68,112 @@ class Op(ABC):
         """Apply effect to a proposed field."""
         return field  # noop
 
+    def refresh(self, field: Field, force=False):
+        """
+        Update the template if it is out of date.
+
+        Args:
+            field (Field): field to build the template against
+            force (bool, optional): update even if the template looks up to date
+
+        Returns:
+            (bool): template is regenerated
+        """
+        # everything `update` reads from the field
+        key = (id(field), field._grid_key(), field.slm.f_slm, field.spectrum)
+        if not force and self._built == key:
+            return False
+
+        self.update(field)
+        self._built = key
+        self._version += 1
+        logger.debug(f"{self.__class__.__name__.lower()} updated, v{self.version}")
+        return True
+
+    def sample(self, field: Field, support):
+        """
+        Template values on a sparse support.
+
+        Args:
+            field (Field): field the template is built against
+            support (Support): where to sample
+        """
+        if self.support is None:
+            return support.gather(self.template)
+        return support.remap(self.template, self.support)
+
     def update(self, field: Field):
         """Trigger update using current field."""
         pass
 
+    ##
+
+    def _parameters(self):
+        """
+        Parameters of the op in `__repr__`, which fingerprints cached results.
+
+        By default, arguments of the constructor, stored as attributes of the same
+        name or with a leading underscore, and the public attributes of the op. Ops
+        whose parameters are stored otherwise have to override it.
+        """
+        names = list(inspect.signature(self.__class__.__init__).parameters)[1:]
+        names += [name for name in vars(self) if not name.startswith("_")]
+
+        parameters = []
+        for name in dict.fromkeys(names):
+            for attr in (name, f"_{name}"):
+                if attr in vars(self) or hasattr(self.__class__, attr):
+                    break
+            else:
+                raise NotImplementedError(
+                    f'{self.__class__.__name__} does not store its parameter "{name}", '
+                    "override _parameters"
+                )
+            parameters.append(f"{name}={_describe(getattr(self, attr))}")
+        return ", ".join(parameters)
+
+    def _touch(self):
+        """Mark parameters as modified."""
+        self._built = None
+
+
+def _describe(value):
+    """Representation of a parameter, arrays are digested instead of truncated."""
+    if isinstance(value, np.ndarray):
+        digest = sha256(np.ascontiguousarray(value).tobytes()).hexdigest()[:16]
+        return f"array({value.shape}, {value.dtype}, {digest})"
+    return repr(value)
+
 
 class Bessel(Op):
+    mode = "add"
+
     def __init__(self, d_out, d_in):
+        super().__init__()
         self._d_out, self._d_in = d_out, d_in
 
+        self._support = None
+
     ##
 
     @property
     def d_in(self):
         return self._d_in
 
+    @d_in.setter
+    def d_in(self, d_in):
+        self._d_in = d_in
+        self._touch()
+
     @property
     def d_out(self):
         return self._d_out
 
+    @d_out.setter
+    def d_out(self, d_out):
+        self._d_out = d_out
+        self._touch()
+
     @property
     def na_in(self):
         return self._na_in
@@ -54,10 +182,24 @@ class Bessel(Op):
     def na_out(self):
         return self._na_out
 
+    @property
+    def support(self):
+        return self._support
+
+    @property
+    def template(self):
+        return self._bessel
+
     ##
 
     def apply(self, field):
-        field += self._bessel
+        if self.support is None:
+            field += self.template
+        elif field.flags.c_contiguous:
+            field.reshape(-1)[self.support.index] += self.template
+        else:
+            # reshape would copy and lose the write
+            field[self.support.coordinates()] += self.template
         return field
 
     def update(self, field):
@@ -72,8 +214,12 @@ class Bessel(Op):
         id_na = c * self.na_in
 
         # generate template
-        bessel = field.polar_k()
-        bessel = (bessel > id_na) & (bessel < od_na)
+        if field.spectrum == "sparse":
+            self._support = field.annulus_support(id_na, od_na)
+            bessel = np.ones(len(self._support), field.dtype)
+        else:
+            self._support = None
+            bessel = field.annulus(id_na, od_na)
 
         # estimate lightsheet profile
         mag_k = field.mag * field.objective.f / field.slm.f_slm  # k-space mag
@@ -86,6 +232,9 @@ class Bessel(Op):
 
         self._bessel = bessel
 
+    def _parameters(self):
+        return f"d_out={self.d_out!r}, d_in={self.d_in!r}"
+
 
 class Lattice(Bessel):
     def __init__(self, d_out, d_in, n_beam, spacing, tilt=0.0):
@@ -98,58 +247,119 @@ class Lattice(Bessel):
     def n_beam(self):
         return self._n_beam
 
+    @n_beam.setter
+    def n_beam(self, n_beam):
+        self._n_beam = n_beam
+        self._touch()
+
     @property
     def spacing(self):
         return self._spacing
 
+    @spacing.setter
+    def spacing(self, spacing):
+        self._spacing = spacing
+        self._touch()
+
+    @property
+    def template(self):
+        return self._lattice
+
     @property
     def tilt(self):
         return self._tilt
 
-    ##
+    @tilt.setter
+    def tilt(self, tilt):
+        self._tilt = tilt
+        self._touch()
 
-    def apply(self, field):
-        field += self._lattice
-        return field
+    ##
 
     def update(self, field):
         # generate bessel template
         super().update(field)
 
-        # tile-corrected grid
-        ky, kx = field.cartesian_k()
-        grid = kx * np.cos(self.tilt) + ky * np.sin(self.tilt)
-
-        # generate position index
+        # tile-corrected grid, only evaluated within the bessel annulus
+        ky, kx = field.cartesian_k(sparse=True)
+        if self.support is None:
+            iy, ix = np.nonzero(self._bessel)
+        else:
+            iy, ix = self.support.coordinates()
+        c, s = (field.dtype.type(f(self.tilt)) for f in (np.cos, np.sin))
+        grid = kx[0, ix] * c + ky[iy, 0] * s
+
+        # mux, beams are placed at offsets (i - (n - 1) / 2) * spacing, their sum
+        #   sum_i exp(1j * offset_i * grid)
+        # is the real-valued Dirichlet kernel sin(n * t / 2) / sin(t / 2)
         n = self.n_beam
-        offsets = np.linspace(-(n - 1) / 2.0, (n - 1) / 2.0, n) * self.spacing
+        lattice = _dirichlet(n, field.dtype.type(self.spacing) * grid)
 
-        # mux
-        n = max(*field.shape)
-        offsets_sum = np.zeros((n,) * 2, np.complex64)
-        for offset in tqdm(offsets):
-            logger.debug(f"offset:{offset}")
-            offsets_sum += np.exp(1j * offset * grid)
+        # energy conservation
+        lattice /= max(*field.domain_shape)
 
         # apply bessel
-        lattice = self._bessel * offsets_sum
-
-        # energy conservation
-        lattice /= n
+        if self.support is None:
+            offsets_sum, lattice = lattice, np.zeros(field.domain_shape, field.dtype)
+            lattice[iy, ix] = offsets_sum
 
         self._lattice = lattice
 
+    def _parameters(self):
+        return (
+            f"{super()._parameters()}, n_beam={self.n_beam!r}, "
+            f"spacing={self.spacing!r}, tilt={self.tilt!r}"
+        )
+
+
+def _dirichlet(n, t):
+    """
+    Evaluate sum of exp(1j * (i - (n - 1) / 2) * t) for i in [0, n).
+
+    Args:
+        n (int): number of terms
+        t (np.ndarray): phase step
+    """
+    # reduce t / 2 to [-pi/2, pi/2] around its nearest pole at k * pi, since
+    # sin(n * (h + k * pi)) / sin(h + k * pi) = (-1)^(k * (n - 1)) * sin(n * h) / sin(h)
+    half = t / 2
+    k = np.rint(half / np.pi)
+    half -= k * np.pi
+    sign = 1 - 2 * ((k * (n - 1)) % 2)
+
+    den = np.sin(half)
+    result = np.sin(half * n)
+    np.divide(result, den, out=result, where=(den != 0))
+    result[den == 0] = n  # limit at the poles
+    result *= sign
+    return result
+
 
 class Defocus(Op):
+    mode = "multiply"
+
     def __init__(self, focus):
+        super().__init__()
         self._focus = focus
 
+        self._defocus = None
+        self._sampled = None  # (support, values)
+
     ##
 
     @property
     def focus(self):
         return self._focus
 
+    @focus.setter
+    def focus(self, focus):
+        self._focus = focus
+        self._touch()
+
+    @property
+    def template(self):
+        return self._defocus
+
     @property
     def weights(self):
         return self._weights
@@ -160,6 +370,23 @@ class Defocus(Op):
         field *= self._defocus
         return field
 
+    def sample(self, field, support):
+        if self._defocus is not None:
+            return super().sample(field, support)
+
+        if self._sampled is None or self._sampled[0] is not support:
+            kz = field.sample_kz(support)
+            self._sampled = (support, np.exp(1j * kz * kz.dtype.type(self.focus)))
+        return self._sampled[1]
+
     def update(self, field):
-        kz = field.kz()
-        self._defocus = np.exp(1j * kz * self.focus)
+        self._sampled = None
+        if field.spectrum == "sparse":
+            # evaluated on the support it is sampled on
+            self._defocus = None
+        else:
+            kz = field.kz()
+            self._defocus = np.exp(1j * kz * kz.dtype.type(self.focus))
+
+    def _parameters(self):
+        return f"focus={self.focus!r}"
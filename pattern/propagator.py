@@ -0,0 +1,299 @@
+import logging
+
+import numpy as np
+
+from .fft import cdft_matrix, cfft2, zoom_cfft2
+from .field import Support
+
+__all__ = ["Propagator"]
+
+# reductions of the excitation volume, evaluated plane by plane
+REDUCTIONS = ("max", "xz", "yz", "energy")
+
+logger = logging.getLogger(__name__)
+
+
+class Propagator(object):
+    """
+    Propagate a filtered pupil field to the objective focal plane over a range of
+    defocus. Planes are processed in chunks, each chunk is a single batched 2-D FFT
+    sized to fit the memory budget. Defocus phase is only evaluated where the pupil
+    is non-zero.
+
+    Args:
+        pupil (np.ndarray): pupil field after the spatial filter
+        kz (np.ndarray): axial wave number of the pupil
+        memory (int, optional): memory budget of a chunk in bytes
+        support (Support, optional): where the pupil is non-zero, e.g. support of
+            the spatial filter, derived from the pupil if not provided
+    """
+
+    def __init__(self, pupil, kz, memory=1 << 29, support=None):
+        if pupil.shape != kz.shape:
+            raise ValueError("pupil and kz have different shapes")
+        self._pupil, self._kz = pupil, kz
+        self._memory = memory
+        self._support = support
+
+    ##
+
+    @property
+    def chunk_size(self):
+        """Number of planes transformed at once."""
+        return max(1, self.memory // self.pupil.nbytes)
+
+    @property
+    def kz(self):
+        return self._kz
+
+    @property
+    def memory(self):
+        return self._memory
+
+    @property
+    def pupil(self):
+        return self._pupil
+
+    @property
+    def support(self):
+        if self._support is None:
+            index = np.flatnonzero(self.pupil)
+            self._support = Support(self.pupil.shape, index)
+            logger.debug(f"pupil support has {len(self._support)} element(s)")
+        return self._support
+
+    ##
+
+    def propagate(self, z):
+        """
+        Iterate over objective fields at each defocus.
+
+        Args:
+            z (np.ndarray): defocus in microns
+
+        Yields:
+            (tuple): defocus of the chunk, objective fields of the chunk, the buffer
+                is reused by the next chunk
+        """
+        for zc, stack in self._defocus(z):
+            yield zc, cfft2(stack, axes=(-2, -1), overwrite_x=True)
+
+    def region(self, z, rows=None, columns=None):
+        """
+        Selected rows and columns of the objective field at each defocus. Selected
+        axes are evaluated by matrix DFTs, the rest by 1-D FFTs, which is a fraction
+        of the cost of the full transform for a few lines or a small region.
+
+        Args:
+            z (np.ndarray): defocus in microns
+            rows (array-like of int, optional): rows to evaluate, default to all
+            columns (array-like of int, optional): columns to evaluate, default to all
+
+        Returns:
+            (np.ndarray): fields of shape (len(z), len(rows), len(columns))
+        """
+        ny, nx = self.pupil.shape
+        wy = None if rows is None else cdft_matrix(ny, rows, self.pupil.dtype)
+        wx = None if columns is None else cdft_matrix(nx, columns, self.pupil.dtype)
+
+        z = np.asarray(z)
+        shape = (
+            ny if wy is None else wy.shape[0],
+            nx if wx is None else wx.shape[0],
+        )
+        result = np.empty((z.size,) + shape, self.pupil.dtype)
+        i = 0
+        for zc, stack in self._defocus(z):
+            # contract the selected axes first, the remaining transform is smaller
+            if wy is not None:
+                stack = np.matmul(wy, stack)
+            if wx is not None:
+                stack = np.matmul(stack, wx.T)
+            if wy is None and wx is None:
+                stack = cfft2(stack, axes=(-2, -1), overwrite_x=True)
+            elif wy is None:
+                stack = cfft2(stack, axes=(-2,), overwrite_x=True)
+            elif wx is None:
+                stack = cfft2(stack, axes=(-1,), overwrite_x=True)
+            result[i : i + zc.size] = stack
+            i += zc.size
+        return result
+
+    def zoom(self, z, ys, xs):
+        """
+        Objective field at each defocus over a region at arbitrary sampling, by the
+        chirp-z transform of the pupil, see `zoom_cfft2`.
+
+        Args:
+            z (np.ndarray): defocus in microns
+            ys (tuple): (start, step, m) of the rows, in bins of the full transform
+                relative to its center
+            xs (tuple): (start, step, m) of the columns
+
+        Returns:
+            (np.ndarray): fields of shape (len(z), ys[2], xs[2])
+        """
+        z = np.asarray(z)
+        result = np.empty((z.size, ys[2], xs[2]), self.pupil.dtype)
+        i = 0
+        for zc, stack in self._defocus(z):
+            result[i : i + zc.size] = zoom_cfft2(stack, ys, xs)
+            i += zc.size
+        return result
+
+    def _defocus(self, z):
+        """
+        Iterate over chunks of the defocused pupil, the buffer is reused by the
+        next chunk.
+        """
+        z = np.asarray(z, self.kz.dtype)
+        n = self.chunk_size
+        logger.debug(f"propagate {z.size} plane(s), {n} plane(s) per chunk")
+
+        index = self.support.index
+        pupil = self.support.gather(self.pupil)
+        phases = _defocus_phases(self.support.gather(self.kz), z)
+
+        buffer = np.empty((min(n, z.size),) + self.pupil.shape, self.pupil.dtype)
+        for start in range(0, z.size, n):
+            zc = z[start : start + n]
+            stack = buffer[: zc.size]
+            # the transform may have overwritten the buffer
+            stack.fill(0)
+            for plane, phase in zip(stack.reshape(zc.size, -1), phases):
+                plane[index] = pupil * phase
+            yield zc, stack
+
+    def xy(self, z):
+        """
+        Maximum projection of each plane along the Y axis.
+
+        Args:
+            z (np.ndarray): defocus in microns
+
+        Returns:
+            (np.ndarray): profile of shape (len(z), nx)
+        """
+        z = np.asarray(z)
+        profile = np.empty((z.size, self.pupil.shape[1]), self.kz.dtype)
+        i = 0
+        for _, stack in self.propagate(z):
+            for plane in stack:
+                profile[i] = _intensity(plane).max(axis=0)
+                i += 1
+        return profile
+
+    def volume(self, z, out=None, reductions=REDUCTIONS):
+        """
+        Intensity of every plane, reduced on the fly. Only a chunk of planes is held
+        in memory, the volume itself is written to `out` if provided.
+
+        Args:
+            z (np.ndarray): defocus in microns
+            out (np.ndarray, optional): array of shape (len(z), ny, nx) to write the
+                volume into, e.g. a memory-mapped .npy
+            reductions (tuple of str, optional): "max" for the maximum projection
+                along Z, "xz" and "yz" for the central slices, "energy" of each plane
+
+        Returns:
+            (dict): requested reductions
+        """
+        z = np.asarray(z)
+        ny, nx = self.pupil.shape
+        results = _allocate_reductions(reductions, z.size, (ny, nx), self.kz.dtype)
+
+        if out is None and set(results) <= {"xz", "yz"}:
+            # central slices alone do not need the full transform
+            if "xz" in results:
+                results["xz"] = _intensity(self.region(z, rows=[ny // 2])[:, 0])
+            if "yz" in results:
+                results["yz"] = _intensity(self.region(z, columns=[nx // 2])[..., 0])
+            return results
+
+        i = 0
+        for _, stack in self.propagate(z):
+            for plane in stack:
+                intensity = _intensity(plane)
+                if out is not None:
+                    out[i] = intensity
+                if "max" in results:
+                    np.maximum(results["max"], intensity, out=results["max"])
+                if "xz" in results:
+                    results["xz"][i] = intensity[ny // 2]
+                if "yz" in results:
+                    results["yz"][i] = intensity[:, nx // 2]
+                if "energy" in results:
+                    results["energy"][i] = intensity.sum(dtype=np.float64)
+                i += 1
+        return results
+
+
+def _merge_reductions(parts):
+    """Combine reductions of consecutive ranges of defocus."""
+    results = dict()
+    for key in parts[0]:
+        arrays = [part[key] for part in parts]
+        if key == "max":
+            results[key] = np.maximum.reduce(arrays)
+        else:
+            results[key] = np.concatenate(arrays)
+    return results
+
+
+def _allocate_reductions(reductions, nz, shape, dtype):
+    unknown = set(reductions) - set(REDUCTIONS)
+    if unknown:
+        raise ValueError(f"unknown reduction(s) {sorted(unknown)}")
+    ny, nx = shape
+    results = dict()
+    if "max" in reductions:
+        results["max"] = np.full(shape, -np.inf, dtype)
+    if "xz" in reductions:
+        results["xz"] = np.empty((nz, nx), dtype)
+    if "yz" in reductions:
+        results["yz"] = np.empty((nz, ny), dtype)
+    if "energy" in reductions:
+        results["energy"] = np.empty(nz, np.float64)
+    return results
+
+
+def _intensity(field):
+    """Equivalent to `field2intensity` without the complex square."""
+    intensity = np.square(field.real)
+    intensity -= np.square(field.imag)
+    return intensity
+
+
+def _defocus_phases(kz, z, n_exact=32):
+    """
+    Iterate over exp(1j * kz * z) of each defocus, the yielded array is reused.
+
+    Evenly spaced defocus are advanced by multiplying a constant step instead of
+    evaluating the exponential again, the phase is resynchronized to its exact value
+    every n_exact planes to bound the accumulated rounding error.
+
+    Args:
+        kz (np.ndarray): axial wave number
+        z (np.ndarray): defocus in microns
+        n_exact (int, optional): interval of the exact evaluations
+    """
+    dz = np.diff(z)
+    even = dz.size > 0 and np.allclose(dz, dz[0])
+    step = _expi(kz * dz[0]) if even else None
+
+    phase = None
+    for i, iz in enumerate(z):
+        if step is None or i % n_exact == 0:
+            phase = _expi(kz * iz, out=phase)
+        else:
+            phase *= step
+        yield phase
+
+
+def _expi(x, out=None):
+    """exp(1j * x) written through the real and imaginary part."""
+    if out is None:
+        out = np.empty(x.shape, np.result_type(x.dtype, np.complex64))
+    np.cos(x, out=out.real)
+    np.sin(x, out=out.imag)
+    return out
@@ -0,0 +1,93 @@
+import logging
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+__all__ = ["SharedArray"]
+
+logger = logging.getLogger(__name__)
+
+
+class SharedArray(object):
+    """
+    Array placed in shared memory. Pickling only transfers its handle, receiving
+    processes attach to the same memory without copying the data.
+
+    Args:
+        shape (tuple of int): shape of the array
+        dtype (np.dtype): data type of the array
+        name (str, optional): attach to an existing block instead of creating one
+    """
+
+    def __init__(self, shape, dtype, name=None):
+        shape, dtype = tuple(shape), np.dtype(dtype)
+        if name is None:
+            size = max(1, int(np.prod(shape)) * dtype.itemsize)
+            self._shm = SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self._shm = _attach(name)
+            self._owner = False
+        self._array = np.ndarray(shape, dtype, buffer=self._shm.buf)
+
+    @classmethod
+    def copy(cls, array):
+        """Create a shared array from an existing array."""
+        shared = cls(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    def __reduce__(self):
+        return (self.__class__, self.handle)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    ##
+
+    @property
+    def array(self):
+        return self._array
+
+    @property
+    def handle(self):
+        """Arguments to attach to the array from another process."""
+        return (self.array.shape, self.array.dtype.str, self.name)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    ##
+
+    def close(self):
+        """Detach from the block, it is released as well if this is the owner."""
+        if self._array is None:
+            return
+        self._array = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+            logger.debug(f'shared memory "{self.name}" released')
+
+
+def _attach(name):
+    """
+    Attach to an existing block without tracking it. Only the owner is responsible
+    for the block, otherwise it is unlinked as soon as the attached process exits.
+    """
+    try:
+        return SharedMemory(name=name, track=False)  # python 3.13+
+    except TypeError:
+        pass
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
@@ -11,6 +11,12 @@ class SLM(object):
         self._pixel_size = pixel_size
         self._f_slm = f_slm
 
+    def __repr__(self):
+        return (
+            f"<{self.__class__.__name__}, shape={tuple(self.shape)}, "
+            f"pixel_size={tuple(self.pixel_size)}, f_slm={self.f_slm!r}>"
+        )
+
     ##
 
     @property
@@ -1,25 +1,56 @@
-from functools import partial
+from collections import namedtuple
+from collections.abc import Mapping
+from contextlib import nullcontext
+from functools import reduce
 import logging
 from typing import Optional
 
 import numpy as np
-from scipy.fftpack import fft2, fftshift, ifftshift
 
-from .field import Field
+from .binary import BinaryPattern
+from .cache import DiskCache
+from .executor import Executor
+from .fft import cfft2, rcfft2, shift_factors, zoom_cfft2
+from .field import Field, Support
 from .mask import Mask
+from . import metrics as metrics_
+from .propagator import REDUCTIONS, _intensity
 
-__all__ = ["Synthesizer"]
+__all__ = ["Synthesizer", "SimulationResults", "CfSearch"]
 
 logger = logging.getLogger(__name__)
 
+# quality metrics of a cropping factor, and their sign to minimize
+CF_METRICS = {"passthrough": -1, "side_lobe": 1, "uniformity": -1, "similarity": 1}
+
+CfSearch = namedtuple("CfSearch", ["cf", "metric", "trace"])
+
 
 class Synthesizer(object):
-    def __init__(self, field: Field, mask: Optional[Mask] = None):
+    def __init__(
+        self,
+        field: Field,
+        mask: Optional[Mask] = None,
+        cache: Optional[DiskCache] = None,
+    ):
         self._field = field
         self._mask = mask  # spatial filter
+        self._cache = cache  # results on disk, keyed by their parameters
+
+        self._base = None  # (key, spectrum) of the cached additive ops
+        self._cf_search = None  # last automatic cf selection
 
     ##
 
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def cf_search(self):
+        """Result of the last `select_cf`, e.g. from `slm_pattern(cf="auto")`."""
+        return self._cf_search
+
     @property
     def field(self):
         return self._field
@@ -36,45 +67,134 @@ class Synthesizer(object):
 
         Args:
             bounded (bool): pattern is bounded to SLM physical size
-        """
-        n = max(*self.field.shape)
-        ideal_field = np.zeros((n,) * 2, np.complex64)
 
-        for op in self.field.ops:
-            ideal_field = op.apply(ideal_field)
+        Returns:
+            (np.ndarray): ideal field, read-only if it is loaded from the cache
+        """
+        if self.cache is not None:
+            key = self.cache.fingerprint("ideal_field", self.field, bounded)
+            return self.cache.lookup(key, lambda: self._ideal_field(bounded))
+        return self._ideal_field(bounded)
+
+    def _ideal_field(self, bounded):
+        ops = self.field.ops
+        for op in ops:
+            op.refresh(self.field)
+
+        # additive ops leading the chain are summed once and reused
+        n_add = next((i for i, op in enumerate(ops) if op.mode != "add"), len(ops))
+        # multiplications commute with the pre-transform modulation of the centered
+        # FFT, in that case it is folded into the cached spectrum as well
+        modulated = all(op.mode == "multiply" for op in ops[n_add:])
+
+        if self.field.spectrum == "sparse":
+            ideal_field = self._sparse_spectrum(ops, n_add)
+            overwrite, modulated = True, True
+        else:
+            ideal_field, overwrite = self._dense_spectrum(ops, n_add, modulated)
 
-        # restore to real space
-        ideal_field = fftshift(fft2(ifftshift(ideal_field)))
-        ideal_field = np.real(ideal_field)
+        # restore to real space, imaginary part is never materialized
+        ideal_field = cfft2(
+            ideal_field, overwrite_x=overwrite, modulated=modulated, real=True
+        )
 
-        # normalize to [-1, 1]
-        ideal_field /= np.abs(ideal_field).max()
+        # normalize to [-1, 1], extrema are found without an absolute copy
+        ideal_field /= max(ideal_field.max(), -ideal_field.min())
 
         # bounded?
         if bounded:
-            slm_roi = np.zeros_like(ideal_field)
-            slm_roi[self.field._roi()] = 1
-            ideal_field *= slm_roi
+            _clear_outside(ideal_field, self.field._roi())
 
         return ideal_field
 
-    def slm_pattern(self, binary=True, cf=0.15, crop=True, bounded=False):
+    def _dense_spectrum(self, ops, n_add, modulated):
+        """
+        Evaluate the op chain on the dense frequency domain.
+
+        Returns:
+            (tuple): spectrum, and whether it is a scratch buffer
+        """
+        base, ops = self._base_spectrum(ops[:n_add], modulated), ops[n_add:]
+
+        if not ops:
+            ideal_field, overwrite = base, False
+        else:
+            if ops[0].mode == "multiply":
+                # fuse the copy of the cached spectrum with the first multiplication
+                ideal_field = np.multiply(base, ops[0].template)
+                ops = ops[1:]
+            else:
+                ideal_field = base.copy()
+            for op in ops:
+                ideal_field = op.apply(ideal_field)
+            overwrite = True
+
+        return ideal_field, overwrite
+
+    def _sparse_spectrum(self, ops, n_add):
+        """
+        Evaluate the op chain on the union of the op supports, the dense spectrum
+        is only assembled right before the transform, modulated for cfft2.
+        """
+        support, base = self._sparse_base_spectrum(ops, n_add)
+
+        values = None
+        for op in ops[n_add:]:
+            sample = op.sample(self.field, support)
+            if values is None:
+                # fuse the copy of the cached coefficients with the first op
+                ufunc = np.add if op.mode == "add" else np.multiply
+                values = ufunc(base, sample)
+            elif op.mode == "add":
+                values += sample
+            else:
+                values *= sample
+        if values is None:
+            values = base.copy()
+
+        # fold in the pre-transform modulation of the centered FFT
+        domain = np.broadcast_to(np.zeros((), values.dtype), support.shape)
+        pre, _ = shift_factors(domain)
+        values *= support.gather(pre)
+
+        return support.scatter(values)
+
+    def slm_pattern(self, binary=True, cf=0.15, crop=True, bounded=False, packed=False):
         """
         Generate target SLM pattern.
 
         Args:
             binary (bool, optional): binary pattern # TODO should be inferred from field.slm
-            cf (float, optional): cropping factor # TODO should be inferred by dithered side lobe ratio
+            cf (float or str, optional): cropping factor, or "auto" to select it by
+                `select_cf` with its default metric
             crop (bool, optiona): crop result to SLM boundary
-            bounded (bool, optional): pattern is bounded to SLM physical size   
+            bounded (bool, optional): pattern is bounded to SLM physical size
+            packed (bool, optional): return a `BinaryPattern`, 1 bit per pixel, which
+                records the search of an automatic cf as its `cf_search`
         """
-        ideal_field = self.ideal_field(bounded)
+        cf_search = None
+        if cf == "auto":
+            cf_search = self.select_cf(bounded=bounded)
+            cf = cf_search.cf
+
+        if self.cache is not None:
+            key = self.cache.fingerprint(
+                "slm_pattern", self.field, binary, cf, crop, bounded
+            )
+            pattern = self.cache.lookup(
+                key, lambda: self._slm_pattern(binary, cf, crop, bounded)
+            )
+        else:
+            pattern = self._slm_pattern(binary, cf, crop, bounded)
+        return BinaryPattern.pack(pattern, cf_search) if packed else pattern
 
-        # remove spurious signals
-        ideal_field[np.abs(ideal_field) <= cf] = 0
+    def _slm_pattern(self, binary, cf, crop, bounded):
+        ideal_field = self.ideal_field(bounded)
 
         if binary:
-            pattern = np.sign(ideal_field) >= 0
+            # spurious signals within [-cf, cf] are removed (set to 0), which then
+            # count as non-negative, the ideal field is left untouched
+            pattern = ideal_field >= -cf
         else:
             raise NotImplementedError("gray-scale pattern generation not vetted yet")
 
@@ -84,100 +204,553 @@ class Synthesizer(object):
 
         return pattern
 
-    ##
-
-    def simulate(self, options, crop=False, zrange=(-100, 100), zstep=10, **kwargs):
-        from multiprocessing import cpu_count, Pool
-
-        results = dict()
+    def sweep_cf(
+        self,
+        cfs,
+        metrics=("passthrough", "similarity"),
+        bounded=False,
+        memory=1 << 29,
+    ):
+        """
+        Evaluate pattern quality over cropping factors. The ideal field is only
+        generated once and thresholded for every cf, the resulting patterns are
+        transformed in batches.
 
-        def save(key, _image, e_field=True):
-            image = _image.copy()
-            if e_field:
-                image = np.square(image)
-                image = np.real(image)
-            results[key] = image
+        Args:
+            cfs (array-like of float): cropping factors
+            metrics (tuple of str, optional): metrics to evaluate, see
+                `pattern.metrics`
+            bounded (bool, optional): pattern is bounded to SLM physical size
+            memory (int, optional): memory budget of a batch in bytes
+
+        Returns:
+            (dict): "cf" and an array of each requested metric
+        """
+        self._require_mask()
+        unknown = set(metrics) - set(CF_METRICS)
+        if unknown:
+            raise ValueError(f"unknown metric(s) {sorted(unknown)}")
+
+        cfs = np.atleast_1d(np.asarray(cfs, np.float64))
+        logger.info(f"sweeping {cfs.size} cf(s)")
+
+        results = {"cf": cfs}
+        results.update(
+            self._cf_metrics(self._cf_reference(bounded), cfs, metrics, memory)
+        )
+        return results
 
-        pattern = self.slm_pattern(crop=False, **kwargs)  # do not crop in the process
-        save("pattern", pattern, e_field=False)
+    def select_cf(
+        self, metric="similarity", bounds=(0.0, 0.2), bounded=False, xtol=1e-3
+    ):
+        """
+        Search for the cropping factor that optimizes a quality metric by Brent's
+        bounded method, which needs far fewer transforms than a dense sweep.
 
-        slm_field = np.exp(1j * pattern * np.pi)
+        Args:
+            metric (str, optional): metric to optimize, "passthrough" and
+                "uniformity" are maximized, "side_lobe" and "similarity" are
+                minimized, see `pattern.metrics`
+            bounds (tuple of float, optional): range of cf to search
+            bounded (bool, optional): pattern is bounded to SLM physical size
+            xtol (float, optional): tolerance of cf
+
+        Returns:
+            (CfSearch): chosen cf, the metric, and (cf, value) of each evaluation
+        """
+        self._require_mask()
+        if metric not in CF_METRICS:
+            raise ValueError(f'unknown metric "{metric}"')
 
-        pre_mask = fftshift(fft2(ifftshift(slm_field)))
-        save("pre_mask", pre_mask)
+        bounds = tuple(float(b) for b in bounds)
 
-        self.mask.calibrate(self.field)
-        post_mask = self.mask(pre_mask.copy())
-        save("post_mask", post_mask)
+        def search():
+            return self._search_cf(metric, bounds, bounded, xtol)
 
-        obj_field = fftshift(fft2(ifftshift(post_mask)))
-        save("excitation_xz", obj_field)
+        if self.cache is not None:
+            key = self.cache.fingerprint(
+                "select_cf", self.field, self.mask, metric, bounds, bounded, xtol
+            )
+            trace = self.cache.lookup(key, search)
+        else:
+            trace = search()
 
-        if "excitation_xy" in options:
-            from tqdm import tqdm
+        values = trace[:, 1] * CF_METRICS[metric]
+        cf = float(trace[np.argmin(values), 0])
+        logger.info(f"cf:{cf:.4f} selected after {len(trace)} evaluation(s)")
 
-            y = np.arange(*zrange, step=zstep)
-            xy = np.zeros((self.field.shape[1], len(y)), dtype=obj_field.dtype)
-            kz = self.field.kz()
+        self._cf_search = CfSearch(cf, metric, trace)
+        return self._cf_search
 
-            """
-            # defocus term
-            defocus = np.einsum("ji,k->jik", kz, y)
-            defocus = np.exp(1j * defocus)
+    def _require_mask(self):
+        if self.mask is None:
+            raise ValueError("cf metrics require a spatial filter, mask is not set")
 
-            # scan over z
-            f = np.einsum("ji,jik->jik", post_mask, defocus)
+    def _search_cf(self, metric, bounds, bounded, xtol):
+        from scipy.optimize import minimize_scalar
 
-            # back to real space
-            f = ifftshift(f, axes=(0, 1))
-            f = fft2(f, axes=(0, 1))
-            f = fftshift(f, axes=(0, 1))
+        # the ideal field, its reference intensity and the mask are reused
+        reference = self._cf_reference(bounded)
 
-            # E field to intensity
-            f = np.square(f)
-            f = np.real(f)
+        trace = []
 
-            # select XY view
-            xy = f.max(axis=0)
-            """
+        def objective(cf):
+            value = self._cf_metrics(reference, [cf], (metric,))[metric][0]
+            logger.debug(f"cf:{cf:.4f}, {metric}:{value:.6g}")
+            trace.append((cf, value))
+            return CF_METRICS[metric] * value
 
-            logger.info("iterating over Y axis")
-            """
-            for i, iy in tqdm(enumerate(y), total=len(y)):
-                f = post_mask * np.exp(1j * kz * iy)
-                f = fftshift(fft2(ifftshift(f)))
+        minimize_scalar(
+            objective, bounds=bounds, method="bounded", options={"xatol": xtol}
+        )
+        return np.array(trace)
 
-                f = np.square(f)
-                f = np.real(f)
+    def _cf_reference(self, bounded):
+        """
+        Ideal field and its peak-normalized intensity, thresholded by cf metrics.
+        """
+        ideal_field = self.ideal_field(bounded)
+        target = np.square(ideal_field)
+        target /= target.max()
+        self.mask.calibrate(self.field)
+        return ideal_field, target
+
+    def _cf_metrics(self, reference, cfs, metrics, memory=1 << 29):
+        """Evaluate metrics of each cf, patterns are thresholded in batches."""
+        ideal_field, target = reference
+        results = {metric: np.empty(len(cfs)) for metric in metrics}
+
+        # patterns are 1 byte per pixel, `metrics.evaluate` holds 2 complex fields
+        # per pattern, a batch fits the budget and is not split again
+        itemsize = np.dtype(self.field.complex_dtype).itemsize
+        n = max(1, memory // (ideal_field.size * (1 + 2 * itemsize)))
+        for start in range(0, len(cfs), n):
+            batch = cfs[start : start + n]
+            patterns = np.empty((len(batch),) + ideal_field.shape, np.bool_)
+            for pattern, cf in zip(patterns, batch):
+                np.greater_equal(ideal_field, -cf, out=pattern)
+
+            values = metrics_.evaluate(
+                patterns,
+                self.mask,
+                metrics,
+                target=target,
+                dtype=self.field.complex_dtype,
+                memory=memory,
+            )
+            for metric in metrics:
+                results[metric][start : start + len(batch)] = values[metric]
 
-                xy[:, i] = f.max(axis=0)
-            """
-            with Pool(cpu_count()) as pool:
-                func = partial(self._simulate_xy, post_mask=post_mask, kz=kz)
-                xy = [r for r in tqdm(pool.imap_unordered(func, y), total=len(y))]
-            xy.sort(key=lambda x: x[0])
-            xy = np.vstack([i for _, i in xy])
+        return results
 
-            save("excitation_xy", xy.T)
+    ##
 
-        if crop:
-            for key, image in results.items():
-                results[key] = image[self.field._roi()]
+    def simulate(
+        self,
+        options,
+        crop=False,
+        zrange=(-100, 100),
+        zstep=10,
+        executor="serial",
+        memory=1 << 29,
+        volume=None,
+        reductions=REDUCTIONS,
+        zoom=None,
+        **kwargs,
+    ):
+        """
+        Simulate the excitation produced by the SLM pattern.
 
-        return results
+        Only the pattern is generated upfront, each output is computed on first
+        access, along with the stages it depends on. Stages and copies that no
+        requested output depends on are skipped.
 
-    def _simulate_xy(self, y, post_mask, kz):
-        defocus = np.exp(1j * kz * y)
+        Args:
+            options (list of str): requested outputs, "pattern", "pre_mask",
+                "post_mask", "excitation_xz", "excitation_xy", "excitation_xyz"
+                for reductions of the excitation volume, saved as
+                "excitation_xyz_<reduction>", or "excitation_zoom" for the focal
+                plane over the `zoom` region, the last two are never cropped
+            crop (bool, optional): crop results to SLM boundary
+            zrange (tuple of float, optional): defocus range of the 3-D excitation
+            zstep (float, optional): defocus step of the 3-D excitation
+            executor (str or Executor, optional): how defocus planes are processed,
+                either a session kept open until the outputs are accessed, or the
+                kind of a temporary session, "serial", "threads" or "processes"
+            memory (int, optional): memory budget in bytes of a temporary session
+            volume (str, optional): .npy file to stream the excitation volume to, it
+                is returned memory-mapped as "excitation_xyz"
+            reductions (tuple of str, optional): reductions of the excitation volume,
+                see `Propagator.volume`
+            zoom (tuple, optional): region of "excitation_zoom", (start, stop, num)
+                of each axis in microns at the sample, sampled as `np.linspace`
+            **kwargs: options for `slm_pattern`
+
+        Returns:
+            (SimulationResults): read-only mapping of the requested outputs, its
+                `cf_search` records the search of an automatic cf
+        """
+        cf_search = None
+        if kwargs.get("cf") == "auto":
+            # resolved upfront, the results record the search and are keyed by the cf
+            cf_search = self.select_cf(bounded=kwargs.get("bounded", False))
+            kwargs["cf"] = cf_search.cf
+        pattern = self.slm_pattern(crop=False, **kwargs)  # do not crop in the process
 
-        f = post_mask * defocus
-        f = fftshift(fft2(ifftshift(f)))
+        key = None
+        if self.cache is not None:
+            key = self.cache.fingerprint(
+                "simulate",
+                self.field,
+                self.mask,
+                sorted(kwargs.items()),
+                crop,
+                zrange,
+                zstep,
+                reductions,
+                zoom,
+            )
+        return SimulationResults(
+            self,
+            options,
+            pattern,
+            crop=crop,
+            z=np.arange(*zrange, step=zstep),
+            executor=executor,
+            memory=memory,
+            volume=volume,
+            reductions=reductions,
+            zoom=zoom,
+            key=key,
+            cf_search=cf_search,
+        )
+
+    def _base_spectrum(self, ops, modulated=False):
+        """
+        Sum of the additive ops, regenerated only when any of them is updated.
 
-        f = np.square(f)
-        f = np.real(f)
+        Args:
+            ops (tuple of Op): additive ops
+            modulated (bool, optional): multiply by the pre-transform factor of cfft2
+        """
+        key = (
+            self.field._grid_key(),
+            tuple((op, op.version) for op in ops),
+            modulated,
+        )
+        if self._base is None or self._base[0] != key:
+            logger.debug(f"summing spectrum of {len(ops)} op(s)")
+            base = np.zeros(self.field.domain_shape, self.field.complex_dtype)
+            for op in ops:
+                base = op.apply(base)
+            if modulated:
+                pre, _ = shift_factors(base)
+                base *= pre
+            base.setflags(write=False)
+            self._base = (key, base)
+        return self._base[1]
+
+    def _sparse_base_spectrum(self, ops, n_add):
+        """
+        Sparse counterpart of `_base_spectrum`, coefficients of the additive ops
+        leading the chain are summed on the union of all the additive op supports.
 
-        return y, f.max(axis=0)
+        Returns:
+            (tuple): support, coefficients on the support
+        """
+        additive = tuple(op for op in ops if op.mode == "add")
+        key = (
+            self.field._grid_key(),
+            tuple((op, op.version) for op in additive),
+            n_add,
+        )
+        if self._base is None or self._base[0] != key:
+            supports = [op.support for op in additive]
+            if not supports or any(s is None for s in supports):
+                raise ValueError(
+                    "sparse spectrum requires additive ops with a sparse support"
+                )
+            support = reduce(Support.union, supports)
+            logger.debug(
+                f"summing coefficients of {n_add} op(s), {len(support)} element(s)"
+            )
+
+            base = np.zeros(len(support), self.field.complex_dtype)
+            for op in ops[:n_add]:
+                base += op.sample(self.field, support)
+            base.setflags(write=False)
+            self._base = (key, (support, base))
+        return self._base[1]
 
     ##
 
     def _dither(self):
         pass
+
+
+def _clear_outside(array, roi):
+    """Zero out the array outside of the region of interest, in-place."""
+    ys, xs = roi
+    array[: ys.start] = 0
+    array[ys.stop :] = 0
+    array[ys, : xs.start] = 0
+    array[ys, xs.stop :] = 0
+
+
+class SimulationResults(Mapping):
+    """
+    Outputs of `Synthesizer.simulate`, evaluated on first access. Intermediate
+    fields are only kept as long as a pending output depends on them, and are
+    transformed in-place once nothing else needs them. Outputs are loaded from, and
+    stored to, the cache of the synthesizer if it has one.
+
+    Args:
+        synth (Synthesizer): synthesizer of the pattern
+        outputs (list of str): requested outputs
+        pattern (np.ndarray or BinaryPattern): uncropped SLM pattern
+        cf_search (CfSearch, optional): search of an automatic cf
+        **kwargs: simulation options, see `Synthesizer.simulate`
+    """
+
+    OUTPUTS = (
+        "pattern",
+        "pre_mask",
+        "post_mask",
+        "excitation_xz",
+        "excitation_xy",
+        "excitation_xyz",
+        "excitation_zoom",
+    )
+
+    def __init__(
+        self,
+        synth,
+        outputs,
+        pattern,
+        crop=False,
+        z=None,
+        executor="serial",
+        memory=1 << 29,
+        volume=None,
+        reductions=REDUCTIONS,
+        zoom=None,
+        key=None,
+        cf_search=None,
+    ):
+        keys = []
+        for output in outputs:
+            if output not in SimulationResults.OUTPUTS:
+                raise ValueError(f'unknown output "{output}"')
+            if output == "excitation_zoom" and zoom is None:
+                raise ValueError('"excitation_zoom" requires a zoom region')
+            if output == "excitation_xyz":
+                keys.extend(f"excitation_xyz_{r}" for r in reductions)
+                if volume is not None:
+                    keys.append("excitation_xyz")
+            else:
+                keys.append(output)
+        self._keys = tuple(dict.fromkeys(keys))
+
+        self._synth = synth
+        self._crop = crop
+        self._z = z
+        self._executor, self._memory = executor, memory
+        self._volume, self._reductions = volume, reductions
+        self._zoom = zoom
+        self._key = key  # fingerprint of the simulation
+        self._cf_search = cf_search
+
+        self._results = dict()
+        # stages
+        self._pattern, self._spectrum, self._pupil = pattern, None, None
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        if key not in self._results and not self._load(key):
+            self._evaluate(key)
+            self._store()
+        return self._results[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        keys = ", ".join(
+            key + ("" if key in self._results else " (pending)") for key in self
+        )
+        return f"<SimulationResults: {keys}>"
+
+    ##
+
+    @property
+    def cf_search(self):
+        """Search of the cf the pattern is generated with, None if it is given."""
+        return self._cf_search
+
+    ##
+
+    def _evaluate(self, key):
+        field = self._synth.field
+        if key == "pattern":
+            self._save(key, np.asarray(self._pattern), e_field=False)
+        elif key == "pre_mask":
+            self._save(key, self._get_spectrum())
+        elif key == "post_mask":
+            self._save(key, self._get_pupil())
+        elif key == "excitation_xz":
+            pupil = self._get_pupil()
+            # last one to use the pupil transforms it in-place
+            overwrite = not self._pending_pupil(exclude=key)
+            if overwrite:
+                self._pupil = None
+            self._save(key, cfft2(pupil, overwrite_x=overwrite))
+        elif key == "excitation_zoom":
+            ys, xs = self._zoom_bins()
+            self._results[key] = _intensity(zoom_cfft2(self._get_pupil(), ys, xs))
+        else:
+            pupil, kz = self._get_pupil(), field.kz()
+            # the pupil is zero outside of a sparse filter, its support is reused
+            support = self._synth.mask.support
+            with self._session() as session:
+                if key == "excitation_xy":
+                    logger.info("iterating over Y axis")
+                    self._save(key, session.xy(pupil, kz, self._z, support).T)
+                else:
+                    # all the reductions come out of a single pass
+                    logger.info("iterating over the excitation volume")
+                    reduced = session.volume(
+                        pupil,
+                        kz,
+                        self._z,
+                        self._volume,
+                        self._reductions,
+                        support,
+                    )
+                    for name, array in reduced.items():
+                        name = "excitation_xyz" + (
+                            "" if name == "volume" else f"_{name}"
+                        )
+                        self._results[name] = array
+        self._release()
+
+    def _save(self, key, image, e_field=True):
+        if e_field:
+            image = _intensity(image) if np.iscomplexobj(image) else np.square(image)
+        if self._crop:
+            image = image[self._synth.field._roi()]
+        self._results[key] = image
+
+    ##
+
+    def _get_spectrum(self):
+        """Field right before the spatial filter."""
+        if self._spectrum is None:
+            slm_field = self._slm_field()
+            if np.iscomplexobj(slm_field):
+                self._spectrum = cfft2(slm_field, overwrite_x=True)
+            else:
+                self._spectrum = rcfft2(slm_field)
+        return self._spectrum
+
+    def _get_pupil(self):
+        """Field right after the spatial filter."""
+        if self._pupil is None:
+            mask = self._synth.mask
+            mask.calibrate(self._synth.field)
+
+            if (
+                self._spectrum is None
+                and not self._pending("pre_mask")
+                and mask.support is not None
+                and self._binary()
+            ):
+                # only the half spectrum on the support is ever evaluated
+                values = rcfft2(self._slm_field(), index=mask.support.index)
+                self._pupil = mask.support.scatter(values)
+                return self._pupil
+
+            spectrum = self._get_spectrum()
+            if self._pending("pre_mask"):
+                spectrum = spectrum.copy()
+            else:
+                # filtered in-place
+                self._spectrum = None
+            self._pupil = mask(spectrum)
+        return self._pupil
+
+    def _binary(self):
+        return self._pattern.dtype == np.bool_
+
+    def _slm_field(self):
+        """
+        Field right after the SLM. Binary phase is real, exp(1j * pi * pattern) is
+        -1 where the pattern is set and 1 elsewhere, and is looked up instead.
+        """
+        dtype = self._synth.field.dtype
+        if isinstance(self._pattern, BinaryPattern):
+            return self._pattern.signs(dtype)
+        if self._binary():
+            return np.where(self._pattern, dtype.type(-1), dtype.type(1))
+        return np.exp(1j * np.pi * self._pattern.astype(dtype))
+
+    def _cacheable(self, key):
+        # the volume is already on disk where it is requested
+        return self._key is not None and key != "excitation_xyz"
+
+    def _load(self, key):
+        """Load an output from the cache, returns whether it is found."""
+        if not self._cacheable(key):
+            return False
+        cache = self._synth.cache
+        array = cache.get(cache.fingerprint(self._key, key))
+        if array is None:
+            return False
+        self._results[key] = array
+        self._release()
+        return True
+
+    def _store(self):
+        """Store newly evaluated outputs to the cache."""
+        cache = self._synth.cache
+        for key, array in self._results.items():
+            if self._cacheable(key) and not isinstance(array, np.memmap):
+                self._results[key] = cache.put(cache.fingerprint(self._key, key), array)
+
+    def _pending(self, key):
+        return key in self._keys and key not in self._results
+
+    def _pending_pupil(self, exclude=None):
+        """Any pending output depends on the filtered field."""
+        return any(
+            self._pending(key)
+            for key in self._keys
+            if key not in ("pattern", "pre_mask", exclude)
+        )
+
+    def _release(self):
+        """Drop stages that no pending output depends on."""
+        if not self._pending_pupil():
+            self._pupil = None
+        if not self._pending("pre_mask") and (
+            self._pupil is not None or not self._pending_pupil()
+        ):
+            self._spectrum = None
+
+    def _zoom_bins(self):
+        """Convert the zoom region to (start, step, m) in bins of the transform."""
+        field = self._synth.field
+        bins = []
+        for (start, stop, num), pitch in zip(self._zoom, field.slm.pixel_size):
+            pitch /= field.mag
+            step = (stop - start) / (num - 1) if num > 1 else 1.0
+            bins.append((start / pitch, step / pitch, int(num)))
+        return bins
+
+    def _session(self):
+        if isinstance(self._executor, Executor):
+            return nullcontext(self._executor)
+        return Executor(self._executor, memory=self._memory)
@@ -3,6 +3,8 @@ import logging
 import numpy as np
 from PIL import Image
 
+from .binary import BinaryPattern
+
 __all__ = ["write_pattern_bmp"]
 
 
@@ -15,5 +17,10 @@ def field2intensity(field):
 
 def write_pattern_bmp(uri, image):
     """Fix binary BMP writeback."""
-    image = Image.frombytes("1", image.shape[::-1], np.packbits(image, axis=1))
+    if isinstance(image, BinaryPattern):
+        # already in the layout of the bitmap
+        bits = image.bits
+    else:
+        bits = np.packbits(image, axis=1)
+    image = Image.frombytes("1", image.shape[::-1], memoryview(bits))
     image.save(uri)
@@ -24,6 +24,6 @@ setup(
         "tqdm",
     ],
     zip_safe=True,
-    extras_require={},
+    extras_require={"fftw": ["pyfftw"]},
     entry_points={"console_scripts": ["repbuild=pattern.cli.reptools:repbuild"]},
 )
@@ -0,0 +1,60 @@
+"""
+Benchmark the executors of the XY excitation scan at QXGA and SXGA sizes.
+"""
+
+import logging
+import os
+import time
+
+import coloredlogs
+import numpy as np
+
+from pattern import SLM, AnnularMask, Bessel, Executor, Field, Objective, Synthesizer
+
+logger = logging.getLogger(__name__)
+
+SLMS = {
+    "qxga": SLM((1536, 2048), (8.2, 8.2), 500),
+    "sxga": SLM((1024, 1280), (13.62, 13.62), 500),
+}
+
+
+def benchmark(synth, kind, workers=None, n_repeat=3, **kwargs):
+    """
+    Time the scan in a warm session.
+
+    Returns:
+        (tuple): best time in seconds, XY excitation
+    """
+    timings = []
+    with Executor(kind, workers=workers) as executor:
+        # the first call spawns the workers
+        for _ in range(n_repeat + 1):
+            t0 = time.perf_counter()
+            results = synth.simulate(["excitation_xy"], executor=executor, **kwargs)
+            xy = results["excitation_xy"]  # evaluated on access
+            timings.append(time.perf_counter() - t0)
+    return min(timings[1:]), xy
+
+
+if __name__ == "__main__":
+    coloredlogs.install(
+        level="INFO", fmt="%(asctime)s %(levelname)s %(message)s", datefmt="%H:%M:%S"
+    )
+
+    mask = AnnularMask(3.824, 2.689)
+    nikon_10x_0p25 = Objective(10, 0.25, 200)
+
+    logger.info(f"{os.cpu_count()} core(s)")
+    for name, slm in SLMS.items():
+        field = Field(slm, nikon_10x_0p25, 0.488, 60)
+        field = Bessel(mask.d_out, mask.d_in)(field)
+        synth = Synthesizer(field, mask)
+
+        reference = None
+        for kind in Executor.KINDS:
+            t, xy = benchmark(synth, kind, zrange=(-50, 50), zstep=2, cf=0.05)
+            if reference is None:
+                reference = xy
+            error = np.abs(xy - reference).max() / reference.max()
+            logger.info(f"[{name}] {kind}: {t:.2f} s, rel. error {error:.1e}")
@@ -0,0 +1,86 @@
+"""
+Benchmark ideal field synthesis against the original unfused implementation.
+"""
+
+import logging
+import timeit
+
+import coloredlogs
+import numpy as np
+from scipy.fftpack import fft2, fftshift, ifftshift
+
+from pattern import SLM, Bessel, Defocus, Field, Objective, Synthesizer
+
+logger = logging.getLogger(__name__)
+
+# full-array passes, FFT excluded
+PASSES_BEFORE = {
+    "allocate": 1,
+    "bessel (add)": 1,
+    "defocus (multiply)": 1,
+    "ifftshift": 1,
+    "fftshift": 1,
+    "abs": 1,
+    "max": 1,
+    "normalize": 1,
+    "bounded (zeros_like, assign, multiply)": 3,
+}
+PASSES_AFTER = {
+    "defocus (multiply, fused with copy of the cached spectrum)": 1,
+    "real part x post-transform factor (real-sized)": 1,
+    "max, min (real-sized)": 2,
+    "normalize (real-sized)": 1,
+    "bounded (outside of roi only)": 0,
+}
+
+
+def ideal_field_before(field, bounded=False):
+    """Reference implementation of Synthesizer.ideal_field prior to fusion."""
+    n = max(*field.shape)
+    ideal_field = np.zeros((n,) * 2, np.complex64)
+
+    for op in field.ops:
+        ideal_field = op.apply(ideal_field)
+
+    ideal_field = fftshift(fft2(ifftshift(ideal_field)))
+    ideal_field = np.real(ideal_field)
+
+    ideal_field /= np.abs(ideal_field).max()
+
+    if bounded:
+        slm_roi = np.zeros_like(ideal_field)
+        slm_roi[field._roi()] = 1
+        ideal_field *= slm_roi
+
+    return ideal_field
+
+
+if __name__ == "__main__":
+    coloredlogs.install(
+        level="INFO", fmt="%(asctime)s %(levelname)s %(message)s", datefmt="%H:%M:%S"
+    )
+
+    qxga = SLM((1536, 2048), (8.2, 8.2), 500)
+    nikon_10x_0p25 = Objective(10, 0.25, 200)
+
+    field = Field(qxga, nikon_10x_0p25, 0.488, 60)
+    field = Bessel(3.824, 2.689)(field)
+    field = Defocus(7)(field)
+
+    synth = Synthesizer(field)
+
+    before = ideal_field_before(field, bounded=True)
+    after = synth.ideal_field(bounded=True)
+    logger.info(f"max abs difference: {np.abs(before - after).max():.3e}")
+
+    n_repeat = 10
+    for name, func, passes in (
+        ("before", lambda: ideal_field_before(field, bounded=True), PASSES_BEFORE),
+        ("after", lambda: synth.ideal_field(bounded=True), PASSES_AFTER),
+    ):
+        t = min(timeit.repeat(func, number=1, repeat=n_repeat))
+        logger.info(
+            f"[{name}] {sum(passes.values())} pass(es) + FFT, {t * 1000:.1f} ms"
+        )
+        for step, n in passes.items():
+            logger.debug(f"[{name}] {step}: {n}")
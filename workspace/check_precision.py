@@ -0,0 +1,59 @@
+"""
+Compare single precision synthesis against the double precision reference.
+"""
+
+import logging
+
+import coloredlogs
+import numpy as np
+
+from pattern import SLM, AnnularMask, Bessel, Field, Lattice, Objective, Synthesizer
+
+logger = logging.getLogger(__name__)
+
+
+def build(dtype, op):
+    qxga = SLM((1536, 2048), (8.2, 8.2), 500)
+    nikon_10x_0p25 = Objective(10, 0.25, 200)
+
+    field = Field(qxga, nikon_10x_0p25, 0.488, 60, dtype=dtype)
+    field = op(field)
+
+    return field
+
+
+def compare(name, op, cf=0.05):
+    fields = {dtype: build(dtype, op) for dtype in (np.float32, np.float64)}
+
+    mask = AnnularMask(3.824, 2.689)
+    results = dict()
+    for dtype, field in fields.items():
+        synth = Synthesizer(field, mask)
+        ideal = synth.ideal_field()
+        pattern = synth.slm_pattern(cf=cf)
+        logger.debug(f"[{name}] {np.dtype(dtype)}, ideal field {ideal.dtype}")
+        results[dtype] = (ideal, pattern)
+
+    (ideal_s, pattern_s), (ideal_d, pattern_d) = (
+        results[np.float32],
+        results[np.float64],
+    )
+    err = np.abs(ideal_s.astype(np.float64) - ideal_d)
+    n_flip = np.count_nonzero(pattern_s != pattern_d)
+    rms = np.sqrt(np.mean(err**2))
+    logger.info(f"[{name}] ideal field, max abs err:{err.max():.3e}, rms err:{rms:.3e}")
+    logger.info(
+        f"[{name}] pattern (cf={cf}), {n_flip} flipped pixel(s), "
+        f"{n_flip / pattern_d.size * 100:.4f}%"
+    )
+
+    return err.max(), n_flip
+
+
+if __name__ == "__main__":
+    coloredlogs.install(
+        level="INFO", fmt="%(asctime)s %(levelname)s %(message)s", datefmt="%H:%M:%S"
+    )
+
+    compare("bessel", Bessel(3.824, 2.689))
+    compare("lattice", Lattice(3.824, 2.689, 7, 3))
@@ -1,75 +1,35 @@
 import logging
 
 import imageio
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from scipy.fftpack import fft2, fftshift, ifftshift
 
-from pattern import SLM, AnnularMask, Bessel, Field, Objective, Lattice
-from pattern.utils import field2intensity
+from pattern import SLM, AnnularMask, Bessel, DiskCache, Field, Objective, Lattice
+from pattern import Synthesizer
 
 logger = logging.getLogger(__name__)
 
 
-def optimize_cf_passthrough(field, cf_range, cf_step=0.01):
-    slm_field_ideal = field.slm_field_ideal()
-
+def optimize_cf_passthrough(synth, cf_range, cf_step=0.01):
     cfs = np.arange(*cf_range, step=cf_step)
-    ratios = []
-    for cf in cfs:
-        logger.debug(f"cf:{cf:.04f}")
-
-        slm_pattern = field.slm_pattern(cf=cf, crop=False)
-        slm_field_bl = np.exp(1j * slm_pattern * np.pi)
-        pupil_field_bl_pre = fftshift(fft2(ifftshift(slm_field_bl)))
-        power_pre = field2intensity(pupil_field_bl_pre).sum()
-        print(power_pre)
-
-        pupil_field_bl_post = field.mask(pupil_field_bl_pre)
-        power_post = field2intensity(pupil_field_bl_post).sum()
-        print(power_post)
-
-        ratios.append(power_post / power_pre)
+    results = synth.sweep_cf(cfs, metrics=("passthrough",))
+    for cf, ratio in zip(cfs, results["passthrough"]):
+        logger.debug(f"cf:{cf:.04f}, passthrough:{ratio:.6f}")
 
-    df = pd.DataFrame({"cf": cfs, "ratio": ratios})
+    df = pd.DataFrame({"cf": cfs, "ratio": results["passthrough"]})
     df.to_csv("cf_intensity.csv", float_format="%f")
 
 
-def optimize_cf_similarity(field, cf_range, cf_step=0.01):
-    slm_field_ideal = field.slm_field_ideal()
-    slm_field_ideal /= slm_field_ideal.max()
-
-    imageio.imwrite("ideal.tif", field2intensity(slm_field_ideal).astype(np.float32))
-
-    shape = slm_field_ideal.shape
-    n = shape[0] * shape[1]
+def optimize_cf_similarity(synth, cf_range, cf_step=0.01):
+    ideal_field = synth.ideal_field()
+    imageio.imwrite("ideal.tif", np.square(ideal_field).astype(np.float32))
 
     cfs = np.arange(*cf_range, step=cf_step)
-    sims = []
-    for cf in cfs:
-        logger.debug(f"cf:{cf:.04f}")
-
-        slm_pattern = field.slm_pattern(cf=cf, crop=False)
-        slm_field_bl = np.exp(1j * slm_pattern * np.pi)
-        pupil_field_bl_pre = fftshift(fft2(ifftshift(slm_field_bl)))
-        pupil_field_bl_post = field.mask(pupil_field_bl_pre)
-
-        obj_field = fftshift(fft2(ifftshift(pupil_field_bl_post)))
-        obj_field /= obj_field.max()
-
-        similarity = np.square(
-            field2intensity(obj_field) - field2intensity(slm_field_ideal)
-        ).sum()
-        print(similarity)
-        sims.append(similarity)
-
-        imageio.imwrite(
-            f"_debug/cf{cf:.04f}_post.tif",
-            field2intensity(obj_field).astype(np.float32),
-        )
-
-    df = pd.DataFrame({"cf": cfs, "similarity": sims})
+    results = synth.sweep_cf(cfs, metrics=("similarity",))
+    for cf, similarity in zip(cfs, results["similarity"]):
+        logger.debug(f"cf:{cf:.04f}, similarity:{similarity:.6f}")
+
+    df = pd.DataFrame({"cf": cfs, "similarity": results["similarity"]})
     df.to_csv("cf_similarity.csv", float_format="%.15f")
 
 
@@ -87,9 +47,11 @@ if __name__ == "__main__":
     mask = AnnularMask(*annulus)
     nikon_10x_0p3 = Objective(10, 0.3, 200)
 
-    field = Field(qxga, mask, nikon_10x_0p3, 0.488, 60)
+    field = Field(qxga, nikon_10x_0p3, 0.488, 60)
 
     field = Lattice(3.824, 2.689, 7, 3)(field)
     # field = Bessel(*annulus)(field)
 
-    optimize_cf_similarity(field, [0, 0.20], 0.01)
+    synth = Synthesizer(field, mask, cache=DiskCache())
+
+    optimize_cf_similarity(synth, [0, 0.20], 0.01)
@@ -9,6 +9,7 @@ from pattern import (
     AnnularMask,
     Bessel,
     Defocus,
+    DiskCache,
     Field,
     Lattice,
     Objective,
@@ -39,9 +40,9 @@ if __name__ == "__main__":
     field = Bessel(mask.d_out, mask.d_in)(field)
     field = Defocus(7)(field)
 
-    synth = Synthesizer(field, mask)
+    synth = Synthesizer(field, mask, cache=DiskCache())
 
-    options = ["excitation_xy"]
+    options = ["excitation_xy", "excitation_xz"]
     results = synth.simulate(
         options, bounded=True, crop=False, zrange=(-50, 50), zstep=2, cf=0.0
     )